@@ -0,0 +1,171 @@
+import asyncio
+import concurrent.futures
+import functools
+import time
+
+from nrf9160_mdm_dfu.api import event_wait
+from nrf9160_mdm_dfu.api import nrf_dfu_API
+from nrf9160_mdm_dfu.api.nrf_dfu_API import NrfDfuErr
+
+
+class AsyncNrfDfu(object):
+    """
+    asyncio front end of nrf_dfu_API.
+
+    The blocking probe calls run on a bounded executor, which can be shared
+    by many devices, and the waits for modem events are awaitable sleeps,
+    so one event loop can drive many DFU sessions without a thread each.
+
+    All keyword arguments other than executor are passed to nrf_dfu_API.
+    """
+
+    def __init__(self, quiet=False, api=None, executor=None, **kwargs):
+        self.dfu = nrf_dfu_API.nrf_dfu_API(quiet=quiet, api=api, **kwargs)
+        self.metrics = self.dfu.metrics
+        self._quiet = quiet
+        self._own_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._executor = executor
+
+    async def _call(self, function, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function, *args, **kwargs))
+
+    async def _sleep(self, delay):
+        # A backend with its own clock, such as the simulator, has to sleep on it.
+        if self.dfu._sleep is time.sleep:
+            await asyncio.sleep(delay)
+        else:
+            await self._call(self.dfu._sleep, delay)
+
+    async def wait_for_event(self, command, nbytes=0):
+        """
+        Awaitable version of nrf_dfu_API.wait_for_event.
+
+        :return NrfDfuErr:
+        """
+        profile = self.dfu.wait_profiles[command]
+        for delay in event_wait.poll_delays(profile, self.dfu.backoff, self.dfu._time, nbytes):
+            if delay > 0:
+                await self._sleep(delay)
+            return_value, event_received = await self._call(self.dfu.get_event_status)
+            if return_value < 0:
+                return return_value
+            if event_received:
+                return NrfDfuErr.SUCCESS
+
+        print ("ERROR: Time out, no event received after %.1f sec." % profile.timeout(nbytes))
+        return NrfDfuErr.TIME_OUT
+
+    async def init(self, snr=None, ipc_path=None):
+        """
+        Awaitable version of nrf_dfu_API.init.
+
+        :return NrfDfuErr:
+        """
+        return_value = await self._call(self.dfu._init_connect, snr)
+        if return_value < 0:
+            return return_value
+
+        with self.metrics.phase("root_key_digest_wait"):
+            return_value = await self.wait_for_event("boot")
+            if return_value < 0:
+                return return_value
+
+        return_value = await self._call(self.dfu._init_program, ipc_path)
+        if return_value < 0:
+            return return_value
+
+        with self.metrics.phase("started_wait"):
+            return_value = await self.wait_for_event("started")
+            if return_value < 0:
+                return return_value
+
+        return await self._call(self.dfu._init_started)
+
+    async def update_firmware(self, hex_file_path, **options):
+        """
+        Awaitable version of nrf_dfu_API.update_firmware.
+
+        Delta, journaled and resumed updates are run as a whole on the executor.
+
+        :return NrfDfuErr:
+        """
+        if any(options.values()):
+            return await self._call(self.dfu.update_firmware, hex_file_path, **options)
+
+        image, plan, erases = await self._call(self.dfu._begin_update, hex_file_path)
+        program_start = self.dfu._time()
+
+        with self.metrics.phase("program") as phase:
+            phase["bytes"] = sum(op.length for op in plan)
+            progress = self.metrics.progress("program", phase["bytes"])
+            for address, length, data in plan:
+                if (not self._quiet):
+                    print("Programming pages from address %s" % hex(address))
+                chunk = await self._call(self.dfu._start_chunk, address, length, data)
+                return_value = await self.wait_for_event("write", length)
+                return_value = await self._call(self.dfu._finish_chunk, chunk, return_value)
+                if return_value < 0:
+                    return return_value
+                progress.advance(address, length, self.dfu.timing["modem_wait"])
+
+        await self._call(self.dfu._end_update, program_start)
+        return NrfDfuErr.SUCCESS
+
+    async def verify_update(self, hex_file_path, fw_digest_path):
+        """
+        Awaitable version of nrf_dfu_API.verify_update.
+
+        :return NrfDfuErr:
+        """
+        if (not self._quiet):
+            print ("Starting verification")
+        image, plan = await self._call(self.dfu._prepared_update, hex_file_path)
+        ranges = [(address, length) for address, length in image.segments if address < nrf_dfu_API.DIGEST_LIMIT]
+
+        with self.metrics.phase("verify") as phase:
+            phase["bytes"] = sum(length for address, length in ranges)
+            await self._call(self.dfu._start_digest, ranges)
+            return_value = await self.wait_for_event("digest", phase["bytes"])
+            if return_value < 0:
+                return return_value
+            return_value = await self._call(self.dfu._check_response)
+            if return_value < 0:
+                return return_value
+
+        return await self._call(self.dfu._match_digest, fw_digest_path)
+
+    async def read_uuid(self):
+        """
+        Awaitable version of nrf_dfu_API.read_uuid.
+
+        :return tuple of NrfDfuErr type and list of UUID characters:
+        """
+        await self._call(self.dfu._start_uuid)
+        return_value = await self.wait_for_event("uuid")
+        if return_value < 0:
+            return return_value, ""
+        return_value = await self._call(self.dfu._check_response, "ERROR: Read failed at %s")
+        if return_value < 0:
+            return return_value, ""
+
+        return NrfDfuErr.SUCCESS, await self._call(self.dfu._uuid_result)
+
+    async def read_digest(self):
+        """
+        Awaitable version of nrf_dfu_API.read_digest.
+
+        :return tuple of NrfDfuErr type and string with digest:
+        """
+        return await self._call(self.dfu.read_digest)
+
+    async def close(self):
+        """
+        Closes the connection to the device, and the executor if it was created here.
+        """
+        return_value = await self._call(self.dfu.close)
+        if self._own_executor:
+            self._executor.shutdown()
+        return return_value
@@ -0,0 +1,101 @@
+import collections
+
+PAGE_SIZE = 8192
+
+
+class WriteOp(collections.namedtuple("WriteOp", ["address", "length", "data"])):
+    """
+    One DFU write command: length bytes of data programmed at address.
+
+    data is a memoryview into the image, it is not copied.
+    """
+    __slots__ = ()
+
+
+def align_block(address, data, page_size=PAGE_SIZE):
+    """
+    Pads a block with 0xFF to whole pages.
+
+    :return tuple of aligned address and data:
+    """
+    front = address % page_size
+    end = front + len(data)
+    back = (page_size - end % page_size) % page_size
+    if front == 0 and back == 0:
+        return address, data
+
+    padded = bytearray(b"\xff" * (end + back))
+    padded[front:end] = data
+    return address - front, padded
+
+
+def plan_chunks(blocks, buffer_size, page_size=PAGE_SIZE):
+    """
+    Plans the write commands for a list of memory blocks.
+
+    Each block is padded to whole pages if needed, and split in chunks of the
+    largest page multiple that fits in buffer_size. Aligned blocks are not
+    copied, the chunks are views into them.
+
+    :param blocks: list of (address, data) tuples, data is any buffer.
+    :param buffer_size: size of the shared DFU buffer in bytes.
+    :return list of WriteOp:
+    """
+    chunk_size = buffer_size - buffer_size % page_size
+    if chunk_size == 0:
+        raise ValueError("buffer_size must be at least one page")
+
+    ops = []
+    for address, data in blocks:
+        address, data = align_block(address, data, page_size)
+        view = memoryview(data)
+        for start in range(0, len(view), chunk_size):
+            chunk = view[start:start + chunk_size]
+            ops.append(WriteOp(address + start, len(chunk), chunk))
+
+    return ops
+
+
+def plan_update(blocks, buffer_size, page_size=PAGE_SIZE):
+    """
+    Plans the commands of an update that does not transfer blank pages.
+
+    Pages that are entirely 0xFF are erased instead of written. Neighbouring
+    blank pages, also in neighbouring blocks, are covered by one erase range.
+    The pages with content are planned as in plan_chunks, chunks never
+    spanning a blank page.
+
+    :param blocks: list of (address, data) tuples, data is any buffer.
+    :param buffer_size: size of the shared DFU buffer in bytes.
+    :return tuple of list of WriteOp and list of (address, length) erase ranges:
+    """
+    chunk_size = buffer_size - buffer_size % page_size
+    if chunk_size == 0:
+        raise ValueError("buffer_size must be at least one page")
+
+    blank_page = b"\xff" * page_size
+    ops = []
+    erases = []
+    for address, data in blocks:
+        address, data = align_block(address, data, page_size)
+        view = memoryview(data)
+        blank = [view[offset:offset + page_size] == blank_page for offset in range(0, len(view), page_size)]
+
+        page = 0
+        while page < len(blank):
+            first = page
+            while page < len(blank) and blank[page] == blank[first]:
+                page += 1
+            start = first * page_size
+            end = page * page_size
+            if blank[first]:
+                if erases and erases[-1][0] + erases[-1][1] == address + start:
+                    erases[-1] = (erases[-1][0], erases[-1][1] + end - start)
+                else:
+                    erases.append((address + start, end - start))
+            else:
+                for offset in range(start, end, chunk_size):
+                    chunk = view[offset:min(offset + chunk_size, end)]
+                    ops.append(WriteOp(address + offset, len(chunk), chunk))
+
+    return ops, erases
@@ -0,0 +1,61 @@
+import binascii
+import os
+import struct
+
+
+class BinWriter(object):
+    """
+    Writes memory read from the modem as a raw binary file.
+    """
+
+    def __init__(self, path):
+        self._file = open(path, "wb")
+
+    def write(self, address, data):
+        self._file.write(data)
+
+    def close(self):
+        self._file.close()
+
+
+class HexWriter(object):
+    """
+    Writes memory read from the modem as an Intel HEX file, record by record.
+    """
+
+    def __init__(self, path, record_size=16):
+        self._file = open(path, "w")
+        self._record_size = record_size
+        self._upper = None
+
+    def _record(self, address, record_type, data):
+        record = struct.pack(">BHB", len(data), address, record_type) + data
+        checksum = (-sum(bytearray(record))) & 0xFF
+        self._file.write(":%s%02X\n" % (binascii.hexlify(record).decode().upper(), checksum))
+
+    def write(self, address, data):
+        data = memoryview(data)
+        position = 0
+        while position < len(data):
+            upper = address >> 16
+            if upper != self._upper:
+                self._record(0, 0x04, struct.pack(">H", upper))
+                self._upper = upper
+            # Records may not cross a 64 KB boundary.
+            count = min(self._record_size, len(data) - position, 0x10000 - (address & 0xFFFF))
+            self._record(address & 0xFFFF, 0x00, data[position:position + count].tobytes())
+            address += count
+            position += count
+
+    def close(self):
+        self._record(0, 0x01, b"")
+        self._file.close()
+
+
+def open_writer(path):
+    """
+    Returns a BinWriter for .bin files and a HexWriter for any other file.
+    """
+    if os.path.splitext(path)[1].lower() == ".bin":
+        return BinWriter(path)
+    return HexWriter(path)
@@ -0,0 +1,69 @@
+import collections
+
+
+class WaitProfile(collections.namedtuple("WaitProfile", ["base", "per_byte", "margin", "min_timeout"])):
+    """
+    Expected duration and timeout of one modem operation.
+
+    The expected duration is base + per_byte * number of bytes handled.
+    The timeout is margin times the expected duration, but at least
+    min_timeout seconds.
+
+    The default expected durations are estimates that match the flash
+    model of sim_probe, not measurements on hardware. The default
+    min_timeout is therefore the 10 s the tool always waited.
+    """
+    __slots__ = ()
+
+    def expected(self, nbytes=0):
+        return self.base + self.per_byte * nbytes
+
+    def timeout(self, nbytes=0):
+        return max(self.min_timeout, self.margin * self.expected(nbytes))
+
+
+class Backoff(collections.namedtuple("Backoff", ["first_fraction", "initial", "factor", "maximum"])):
+    """
+    Polling schedule while waiting for a modem event.
+
+    The first poll happens after first_fraction of the expected duration
+    of the WaitProfile. As the default expected durations are not
+    calibrated on hardware, the default first_fraction is 0: the first poll
+    is immediate. After that the interval starts at initial seconds and
+    grows by factor up to maximum seconds.
+    """
+    __slots__ = ()
+
+
+
+def poll_delays(profile, backoff, clock, nbytes=0):
+    """
+    Yields the delay before every poll of a wait for a modem event, and
+    ends once the timeout of the profile has passed.
+
+    :param clock: function returning the current time in seconds.
+    """
+    timeout = profile.timeout(nbytes)
+    start_time = clock()
+
+    delay = backoff.first_fraction * profile.expected(nbytes)
+    interval = backoff.initial
+    while True:
+        yield delay
+        elapsed = clock() - start_time
+        if elapsed > timeout:
+            return
+        delay = min(interval, timeout - elapsed)
+        interval = min(interval * backoff.factor, backoff.maximum)
+
+DEFAULT_BACKOFF = Backoff(first_fraction=0.0, initial=0.001, factor=2.0, maximum=0.05)
+
+DEFAULT_WAIT_PROFILES = {
+    "boot":    WaitProfile(base=0.2,   per_byte=0.0,    margin=1.0, min_timeout=10.0),
+    "started": WaitProfile(base=0.1,   per_byte=0.0,    margin=1.0, min_timeout=10.0),
+    "erase":   WaitProfile(base=0.01,  per_byte=5e-6,   margin=4.0, min_timeout=10.0),
+    "write":   WaitProfile(base=0.01,  per_byte=1e-5,   margin=4.0, min_timeout=10.0),
+    "read":    WaitProfile(base=0.005, per_byte=2e-7,   margin=4.0, min_timeout=10.0),
+    "digest":  WaitProfile(base=0.005, per_byte=1e-7,   margin=4.0, min_timeout=10.0),
+    "uuid":    WaitProfile(base=0.005, per_byte=0.0,    margin=1.0, min_timeout=10.0),
+}
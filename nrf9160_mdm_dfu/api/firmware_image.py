@@ -0,0 +1,210 @@
+import bisect
+import hashlib
+import mmap
+import os
+import struct
+import tempfile
+
+PAGE_SIZE = 8192
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser("~"), ".nrf9160_mdm_dfu", "images")
+
+# Version 2 keeps the segment table in hex file order.
+_MAGIC = b"NRFDFUI2"
+_HEADER = struct.Struct("<8sII")
+_SEGMENT = struct.Struct("<II")
+_BLOCK = struct.Struct("<III")
+
+
+class FirmwareImage(object):
+    """
+    Pre-processed firmware image.
+
+    Holds the segment table of the hex file, used for verification, and the
+    image data as page aligned, 0xFF padded blocks in address order, used
+    for programming.
+    Images loaded from the cache are memory mapped.
+    """
+
+    def __init__(self, sha256, segments, blocks, data, cache_file=None):
+        """
+        :param segments: list of (address, length) tuples in the order of the hex file.
+            The digest of the segments depends on this order.
+        :param blocks: list of (address, length, offset) tuples into data.
+        :param data: buffer holding the data of all blocks.
+        """
+        self.sha256 = sha256
+        self.segments = segments
+        self._blocks = blocks
+        self._data = data
+        self._cache_file = cache_file
+
+    def blocks(self):
+        """
+        :return list of (address, memoryview) tuples, one per page aligned block:
+        """
+        view = memoryview(self._data)
+        return [(address, view[offset:offset + length]) for address, length, offset in self._blocks]
+
+    def segment_data(self):
+        """
+        :return list of (address, memoryview) tuples, one per hex file segment, without padding:
+        """
+        view = memoryview(self._data)
+        block_addresses = [block[0] for block in self._blocks]
+        segments = []
+        for address, length in self.segments:
+            block = bisect.bisect_right(block_addresses, address) - 1
+            block_address, block_length, block_offset = self._blocks[block]
+            offset = block_offset + address - block_address
+            segments.append((address, view[offset:offset + length]))
+        return segments
+
+    @property
+    def size(self):
+        return sum(length for address, length, offset in self._blocks)
+
+    def close(self):
+        if self._cache_file is not None:
+            self._data.close()
+            self._cache_file.close()
+            self._cache_file = None
+
+
+def file_sha256(path):
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def parse_hex(hex_file_path, sha256=None):
+    """
+    Parses an Intel HEX file into a FirmwareImage held in memory.
+    """
+    from pynrfjprog import Hex
+
+    if sha256 is None:
+        sha256 = file_sha256(hex_file_path)
+
+    segments = []
+    blocks = []
+    data = bytearray()
+    parsed = list(Hex.Hex(hex_file_path))
+    for segment in parsed:
+        segments.append((segment.address, len(segment.data)))
+
+    # Blocks are built in address order, so overlapping and adjacent segments are merged.
+    for segment in sorted(parsed, key=lambda segment: segment.address):
+        address = segment.address
+        length = len(segment.data)
+
+        start = address - address % PAGE_SIZE
+        end = address + length
+        end += (PAGE_SIZE - end % PAGE_SIZE) % PAGE_SIZE
+
+        if blocks and start <= blocks[-1][0] + blocks[-1][1]:
+            # The segment continues or shares a page with the previous block, extend it.
+            block_address, block_length, block_offset = blocks[-1]
+            new_length = max(block_length, end - block_address)
+            data += b"\xff" * (new_length - block_length)
+            blocks[-1] = (block_address, new_length, block_offset)
+        else:
+            blocks.append((start, end - start, len(data)))
+            data += b"\xff" * (end - start)
+            block_address, block_offset = start, blocks[-1][2]
+
+        offset = block_offset + address - block_address
+        data[offset:offset + length] = bytes(segment.data)
+
+    return FirmwareImage(sha256, segments, blocks, data)
+
+
+def load_image(hex_file_path, cache_dir=None):
+    """
+    Returns the FirmwareImage for a hex file.
+
+    The pre-processed image is cached in cache_dir under the SHA-256 of the
+    hex file, so each firmware is parsed once. If the cache can not be
+    written the image is parsed and kept in memory.
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+
+    sha256 = file_sha256(hex_file_path)
+    return load_image_with_sha256(hex_file_path, sha256, cache_dir)
+
+
+def load_image_with_sha256(hex_file_path, sha256, cache_dir=None):
+    """
+    Returns the FirmwareImage for a hex file whose SHA-256 is already known.
+    """
+    if cache_dir is None:
+        cache_dir = DEFAULT_CACHE_DIR
+
+    cache_path = os.path.join(cache_dir, sha256 + ".bin")
+
+    if os.path.isfile(cache_path):
+        try:
+            return _read_cache(cache_path, sha256)
+        except (IOError, OSError, ValueError):
+            # Unreadable, or written by an older version: parse and cache it again.
+            pass
+
+    image = parse_hex(hex_file_path, sha256)
+    try:
+        _write_cache(image, cache_dir, cache_path)
+    except (IOError, OSError):
+        return image
+
+    try:
+        return _read_cache(cache_path, sha256)
+    except (IOError, OSError, ValueError):
+        return image
+
+
+def _write_cache(image, cache_dir, cache_path):
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, "wb") as f:
+        f.write(_HEADER.pack(_MAGIC, len(image.segments), len(image._blocks)))
+        for segment in image.segments:
+            f.write(_SEGMENT.pack(*segment))
+        for block in image._blocks:
+            f.write(_BLOCK.pack(*block))
+        f.write(image._data)
+    os.replace(temp_path, cache_path)
+
+
+def _read_cache(cache_path, sha256):
+    cache_file = open(cache_path, "rb")
+    try:
+        data = mmap.mmap(cache_file.fileno(), 0, access=mmap.ACCESS_READ)
+    except Exception:
+        cache_file.close()
+        raise
+
+    magic, segment_count, block_count = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC:
+        data.close()
+        cache_file.close()
+        raise ValueError("Invalid image cache file: %s" % cache_path)
+
+    position = _HEADER.size
+    segments = []
+    for i in range(segment_count):
+        segments.append(_SEGMENT.unpack_from(data, position))
+        position += _SEGMENT.size
+
+    blocks = []
+    for i in range(block_count):
+        blocks.append(_BLOCK.unpack_from(data, position))
+        position += _BLOCK.size
+
+    # Block offsets are relative to the data following the tables.
+    blocks = [(address, length, position + offset) for address, length, offset in blocks]
+
+    return FirmwareImage(sha256, segments, blocks, data, cache_file)
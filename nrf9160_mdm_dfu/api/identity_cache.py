@@ -0,0 +1,66 @@
+import json
+import os
+import tempfile
+import time
+
+DEFAULT_IDENTITY_DIR = os.path.join(os.path.expanduser("~"), ".nrf9160_mdm_dfu", "identity")
+
+
+class IdentityCache(object):
+    """
+    Last known identity of the device on each probe.
+
+    One JSON file per probe serial number holds the FICR DEVICEID of the
+    chip, the modem UUID, the modem root key digest, the digest of the last
+    verified firmware update and the time the entry was last changed. A
+    field that is not known is None.
+    """
+
+    def __init__(self, directory=None):
+        if directory is None:
+            directory = DEFAULT_IDENTITY_DIR
+        self.directory = directory
+
+    def _path(self, snr):
+        return os.path.join(self.directory, "%d.json" % snr)
+
+    def get(self, snr):
+        """
+        :return identity dict of the device on probe snr, or None:
+        """
+        try:
+            with open(self._path(snr)) as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return None
+
+    def update(self, snr, **fields):
+        """
+        Sets fields of the identity of the device on probe snr, e.g. uuid="...".
+
+        :return the updated identity dict:
+        """
+        identity = self.get(snr)
+        if identity is None:
+            identity = {"snr": snr, "deviceid": None, "uuid": None, "root_key_digest": None, "fw_digest": None}
+        identity.update(fields)
+        identity["timestamp"] = time.time()
+
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            fd, temp_path = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(identity, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self._path(snr))
+        except (IOError, OSError):
+            # Without the cache the identity is read from the device next time.
+            pass
+
+        return identity
+
+    def forget(self, snr):
+        try:
+            os.remove(self._path(snr))
+        except OSError:
+            pass
@@ -0,0 +1,114 @@
+import hashlib
+import json
+import os
+import tempfile
+
+from nrf9160_mdm_dfu.api import firmware_image
+
+IPC_SUFFIX = ".ipc_dfu.signed.ihex"
+
+DEFAULT_INDEX_DIR = os.path.join(os.path.expanduser("~"), ".nrf9160_mdm_dfu", "ipc")
+
+
+class IpcCatalog(object):
+    """
+    Index of the IPC DFU executables found in a directory tree.
+
+    Executables are keyed by the modem root key digest prefix in their file
+    name, e.g. 0001020.ipc_dfu.signed.ihex, and may be anywhere below the
+    directory. The parsed executables are kept in the firmware image cache.
+    The index remembers the size, mtime and SHA-256 of every file, so a file
+    is only hashed and parsed again after it has changed.
+    """
+
+    def __init__(self, directory, index_dir=None, cache_dir=None):
+        if index_dir is None:
+            index_dir = DEFAULT_INDEX_DIR
+        self.directory = os.path.abspath(directory)
+        self._cache_dir = cache_dir
+        # One index per directory tree.
+        name = hashlib.sha256(self.directory.encode("utf-8")).hexdigest()[:16] + ".json"
+        self._index_path = os.path.join(index_dir, name)
+        self.entries = {}
+        self.scan()
+
+    def scan(self):
+        """
+        Walks the directory tree and updates the index.
+        """
+        known = {}
+        try:
+            with open(self._index_path) as f:
+                known = {entry["path"]: entry for entry in json.load(f)}
+        except (IOError, OSError, ValueError, KeyError):
+            pass
+
+        entries = {}
+        for root, dirs, files in os.walk(self.directory):
+            dirs.sort()
+            for file_name in sorted(files):
+                if not file_name.endswith(IPC_SUFFIX):
+                    continue
+                prefix = file_name[:-len(IPC_SUFFIX)].upper()
+                if prefix in entries:
+                    # The first executable found for a prefix is used.
+                    continue
+                entry = self._entry(os.path.join(root, file_name), known)
+                if entry is not None:
+                    entries[prefix] = entry
+
+        self.entries = entries
+        self._write_index()
+
+    def lookup(self, modem_digest):
+        """
+        Returns the parsed IPC DFU executable for a modem root key digest.
+
+        :return FirmwareImage, or None if the catalog has no executable for the digest:
+        """
+        prefix = modem_digest[0:7].upper()
+        entry = self.entries.get(prefix)
+        if entry is None:
+            return None
+
+        current = self._entry(entry["path"], {entry["path"]: entry})
+        if current is None:
+            del self.entries[prefix]
+            return None
+        if current is not entry:
+            self.entries[prefix] = current
+            self._write_index()
+
+        return firmware_image.load_image_with_sha256(current["path"], current["sha256"], self._cache_dir)
+
+    def _entry(self, path, known):
+        """
+        :return index entry of path, the known entry if the file has not changed:
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        entry = known.get(path)
+        if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+            return entry
+
+        sha256 = firmware_image.file_sha256(path)
+        # Parse once now, so the lookup during init only maps the cache file.
+        firmware_image.load_image_with_sha256(path, sha256, self._cache_dir).close()
+        return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime, "sha256": sha256}
+
+    def _write_index(self):
+        try:
+            directory = os.path.dirname(self._index_path)
+            if not os.path.isdir(directory):
+                os.makedirs(directory)
+            fd, temp_path = tempfile.mkstemp(dir=directory)
+            with os.fdopen(fd, "w") as f:
+                json.dump(sorted(self.entries.values(), key=lambda entry: entry["path"]), f, indent=1)
+            os.replace(temp_path, self._index_path)
+        except (IOError, OSError):
+            # Without an index every file is hashed on the next scan.
+            pass
+
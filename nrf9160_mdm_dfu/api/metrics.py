@@ -0,0 +1,195 @@
+import collections
+import contextlib
+import json
+import os
+import tempfile
+import time
+
+
+class DfuMetrics(object):
+    """
+    Collects timing and counters of a DFU session.
+
+    Every finished phase and every programmed chunk is kept as a record
+    (a dict), so the session can be exported as JSON lines or summarised
+    into a Prometheus textfile.
+    """
+
+    def __init__(self, clock=time.time):
+        """
+        :param clock: function returning the current time in seconds, e.g.
+            the virtual clock of the simulator.
+        """
+        self.clock = clock
+        self.records = []
+        self.polls = 0
+        self.listeners = []
+
+    def add_listener(self, listener):
+        """
+        Calls listener(event) for every record as it is made, when a phase
+        starts and while data is transferred.
+
+        Events are dicts with a "type" like the records: "phase_start",
+        "phase", "chunk", "progress", ... Progress events are only made
+        while there are listeners and are not kept as records.
+        """
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def _emit(self, event):
+        for listener in self.listeners:
+            listener(event)
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Times the enclosed block as phase name.
+
+        Yields a dict; fields stored in it, such as "bytes", are added to
+        the phase record.
+        """
+        fields = {}
+        polls = self.polls
+        start = self.clock()
+        if self.listeners:
+            self._emit({"type": "phase_start", "phase": name, "start": start})
+        try:
+            yield fields
+        finally:
+            self.record("phase", phase=name, start=start, duration=self.clock() - start,
+                        polls=self.polls - polls, **fields)
+
+    def record(self, record_type, **fields):
+        fields["type"] = record_type
+        self.records.append(fields)
+        if self.listeners:
+            self._emit(fields)
+
+    def progress(self, phase, total):
+        """
+        :return Progress of phase, that transfers total bytes:
+        """
+        return Progress(self, phase, total)
+
+    def summary(self):
+        """
+        :return dict mapping phase name to its total duration, poll count and bytes:
+        """
+        phases = {}
+        for record in self.records:
+            if record["type"] != "phase":
+                continue
+            phase = phases.setdefault(record["phase"], {"duration": 0.0, "polls": 0, "bytes": 0})
+            phase["duration"] += record["duration"]
+            phase["polls"] += record["polls"]
+            phase["bytes"] += record.get("bytes", 0)
+        return phases
+
+    def write_json_lines(self, path, **labels):
+        """
+        Appends one JSON line per record to path, each with the given labels.
+        """
+        with open(path, "a") as f:
+            for record in self.records:
+                line = dict(labels)
+                line.update(record)
+                f.write(json.dumps(line, sort_keys=True) + "\n")
+
+    def write_prometheus(self, path, **labels):
+        """
+        Writes the phase summary as a Prometheus node exporter textfile.
+
+        The file is replaced atomically so the exporter never reads a partial file.
+        """
+        write_prometheus(path, [(self, labels)])
+
+
+def write_prometheus(path, sessions):
+    """
+    Writes the phase summaries of several sessions to one Prometheus node
+    exporter textfile.
+
+    :param sessions: list of (DfuMetrics, labels dict), e.g. one per device
+        with an "snr" label.
+    """
+    def line(name, value, labels, phase=None):
+        label_text = ",".join('%s="%s"' % (key, labels[key]) for key in sorted(labels))
+        if phase is not None:
+            label_text = ",".join(text for text in ('phase="%s"' % phase, label_text) if text)
+        return "%s{%s} %s\n" % (name, label_text, repr(float(value)))
+
+    # Samples of one metric must be grouped under its TYPE line.
+    families = collections.OrderedDict((name, []) for name in (
+        "nrf9160_dfu_phase_duration_seconds", "nrf9160_dfu_phase_polls",
+        "nrf9160_dfu_phase_bytes", "nrf9160_dfu_phase_bytes_per_second",
+        "nrf9160_dfu_last_run_timestamp_seconds"))
+    for session, labels in sessions:
+        for name, phase in sorted(session.summary().items()):
+            families["nrf9160_dfu_phase_duration_seconds"].append(
+                line("nrf9160_dfu_phase_duration_seconds", phase["duration"], labels, name))
+            families["nrf9160_dfu_phase_polls"].append(line("nrf9160_dfu_phase_polls", phase["polls"], labels, name))
+            if phase["bytes"]:
+                families["nrf9160_dfu_phase_bytes"].append(line("nrf9160_dfu_phase_bytes", phase["bytes"], labels, name))
+                if phase["duration"] > 0:
+                    families["nrf9160_dfu_phase_bytes_per_second"].append(
+                        line("nrf9160_dfu_phase_bytes_per_second", phase["bytes"] / phase["duration"], labels, name))
+        families["nrf9160_dfu_last_run_timestamp_seconds"].append(
+            line("nrf9160_dfu_last_run_timestamp_seconds", time.time(), labels))
+
+    text = []
+    for name, lines in families.items():
+        if lines:
+            text.append("# TYPE %s gauge\n" % name)
+            text += lines
+
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "w") as f:
+        f.writelines(text)
+    os.chmod(temp_path, 0o644)
+    os.replace(temp_path, path)
+
+
+class Progress(object):
+    """
+    Reports the progress of a transfer to the listeners of a DfuMetrics.
+
+    Every advance makes a "progress" event with the chunk address, the
+    bytes done and total, the throughput of the last chunk and on average
+    in bytes per second, the time spent waiting on the modem, the elapsed
+    time and the estimated time left in seconds.
+    """
+
+    def __init__(self, metrics, phase, total):
+        self._metrics = metrics
+        self.phase = phase
+        self.total = total
+        self.done = 0
+        self.start = metrics.clock()
+        self._last = self.start
+
+    def advance(self, address, nbytes, modem_wait=None):
+        """
+        :param nbytes: bytes transferred since the last advance.
+        :param modem_wait: total time waited on the modem in this phase, if known.
+        """
+        self.done += nbytes
+        if not self._metrics.listeners:
+            return
+
+        now = self._metrics.clock()
+        elapsed = now - self.start
+        chunk_time = now - self._last
+        self._last = now
+        average = self.done / elapsed if elapsed > 0 else 0.0
+        eta = None
+        if average > 0:
+            eta = (self.total - self.done) / average
+        self._metrics._emit({"type": "progress", "phase": self.phase, "address": address,
+                             "bytes": self.done, "total": self.total,
+                             "throughput": nbytes / chunk_time if chunk_time > 0 else 0.0,
+                             "average_throughput": average, "modem_wait": modem_wait,
+                             "elapsed": elapsed, "eta": eta})
@@ -0,0 +1,186 @@
+import concurrent.futures
+import time
+
+from nrf9160_mdm_dfu.api import identity_cache
+from nrf9160_mdm_dfu.api import ipc_catalog
+from nrf9160_mdm_dfu.api import nrf_dfu_API
+from nrf9160_mdm_dfu.api.nrf_dfu_API import NrfDfuErr
+
+
+class DeviceJob(object):
+    """
+    Everything a worker process needs to update one device.
+    """
+
+    def __init__(self, snr, fw_path, fw_digest_path, ipc_path=None, simulate=False, update_options=None, ipc_dir=None):
+        """
+        :param update_options: dict of keyword arguments for update_firmware.
+        :param ipc_dir: directory tree to find the IPC DFU executable in.
+        """
+        self.snr = snr
+        self.fw_path = fw_path
+        self.fw_digest_path = fw_digest_path
+        self.ipc_path = ipc_path
+        self.simulate = simulate
+        if update_options is None:
+            update_options = {}
+        self.update_options = update_options
+        self.ipc_dir = ipc_dir
+
+
+class DeviceResult(object):
+    """
+    Outcome of updating one device.
+
+    :param step: the step that failed, or None when the update succeeded.
+    :param retries: number of chunks retried during the update.
+    :param records: the metrics records of the session, see metrics.DfuMetrics.
+    """
+
+    def __init__(self, snr, result, step=None, duration=0.0, error=None, retries=0, records=None):
+        self.snr = snr
+        self.result = result
+        self.step = step
+        self.duration = duration
+        self.error = error
+        self.retries = retries
+        if records is None:
+            records = []
+        self.records = records
+
+    @property
+    def success(self):
+        return self.result == NrfDfuErr.SUCCESS
+
+
+def enumerate_probes():
+    """
+    Returns the serial numbers of all connected J-Link probes.
+    """
+    from pynrfjprog import API
+
+    api = API.API("NRF91")
+    api.open()
+    try:
+        snrs = api.enum_emu_snr()
+    finally:
+        api.close()
+
+    return snrs or []
+
+
+def update_device(job):
+    """
+    Runs init, update_firmware and verify_update on one device.
+
+    Runs in a worker process with its own probe API instance.
+
+    :return DeviceResult:
+    """
+    start = time.time()
+    probe = None
+    if job.simulate:
+        from nrf9160_mdm_dfu.api import sim_probe
+        probe = sim_probe.SimulatedProbe(snr=job.snr)
+
+    try:
+        catalog = None
+        if job.ipc_dir is not None:
+            catalog = ipc_catalog.IpcCatalog(job.ipc_dir)
+        nrf_dfu = nrf_dfu_API.nrf_dfu_API(quiet=True, api=probe, ipc_catalog=catalog,
+                                          identity_cache=identity_cache.IdentityCache())
+    except Exception as e:
+        return DeviceResult(job.snr, NrfDfuErr.NRFJPROG_ERRROR, "open", time.time() - start, str(e))
+
+    step = "init"
+    try:
+        nrf_dfu.prepare_update(job.fw_path)
+        result = nrf_dfu.init(job.snr, job.ipc_path)
+        if result == NrfDfuErr.SUCCESS:
+            step = "update"
+            result = nrf_dfu.update_firmware(job.fw_path, **job.update_options)
+        if result == NrfDfuErr.SUCCESS:
+            step = "verify"
+            result = nrf_dfu.verify_update(job.fw_path, job.fw_digest_path)
+        error = None
+        if nrf_dfu.failed_address is not None:
+            error = "verification failed at %s" % hex(nrf_dfu.failed_address)
+    except Exception as e:
+        result = NrfDfuErr.NRFJPROG_ERRROR
+        error = str(e)
+
+    try:
+        nrf_dfu.close()
+    except Exception:
+        pass
+
+    if result == NrfDfuErr.SUCCESS:
+        step = None
+    return DeviceResult(job.snr, NrfDfuErr(result), step, time.time() - start, error, nrf_dfu.retries,
+                        nrf_dfu.metrics.records)
+
+
+def update_devices(jobs, max_workers=None, max_per_controller=None, controllers=None):
+    """
+    Updates many devices in parallel, one worker process per device.
+
+    :param jobs: list of DeviceJob.
+    :param max_workers: total number of devices updated at the same time.
+    :param max_per_controller: max number of devices updated at the same
+        time on one USB controller.
+    :param controllers: dict mapping SNR to a USB controller name. Devices
+        not in the dict share one controller.
+    :return list of DeviceResult in the order of jobs:
+    """
+    if max_per_controller is not None and max_per_controller < 1:
+        raise ValueError("max_per_controller must be at least 1")
+    if max_workers is None:
+        max_workers = len(jobs)
+    max_workers = max(1, min(max_workers, len(jobs)))
+    if controllers is None:
+        controllers = {}
+
+    pending = list(jobs)
+    active = {}
+    busy = {}
+    results = {}
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=max_workers) as executor:
+        while pending or active:
+            # Start every job whose controller still has a free slot.
+            for job in list(pending):
+                if len(active) >= max_workers:
+                    break
+                controller = controllers.get(job.snr)
+                if max_per_controller is not None and busy.get(controller, 0) >= max_per_controller:
+                    continue
+                pending.remove(job)
+                busy[controller] = busy.get(controller, 0) + 1
+                active[executor.submit(update_device, job)] = job
+
+            done, _ = concurrent.futures.wait(active, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                job = active.pop(future)
+                controller = controllers.get(job.snr)
+                busy[controller] -= 1
+                try:
+                    results[job.snr] = future.result()
+                except Exception as e:
+                    results[job.snr] = DeviceResult(job.snr, NrfDfuErr.NRFJPROG_ERRROR, error=str(e))
+
+    return [results[job.snr] for job in jobs]
+
+
+def print_summary(results):
+    """
+    Prints one table line per device and a total.
+    """
+    print("%-12s %-22s %-8s %10s %8s" % ("SNR", "Result", "Step", "Time [s]", "Retries"))
+    for device in results:
+        print("%-12s %-22s %-8s %10.1f %8d" % (device.snr, device.result.name, device.step or "", device.duration,
+                                               device.retries))
+        if device.error:
+            print("    %s" % device.error)
+
+    passed = len([device for device in results if device.success])
+    print("%d of %d devices updated" % (passed, len(results)))
@@ -1,16 +1,41 @@
-from pynrfjprog import API
 import time
 import sys
 import argparse
 import time
-import codecs
 import mmap
+import os
 import enum
-from intelhex import IntelHex
-from pynrfjprog import Hex
+import hashlib
+import binascii
+import concurrent.futures
+import struct
+import re
+from nrf9160_mdm_dfu.api import chunk_planner
+from nrf9160_mdm_dfu.api import dump_writer
+from nrf9160_mdm_dfu.api import event_wait
+from nrf9160_mdm_dfu.api import firmware_image
+from nrf9160_mdm_dfu.api import metrics
+from nrf9160_mdm_dfu.api import register_script
+from nrf9160_mdm_dfu.api import tuning
+from nrf9160_mdm_dfu.api import update_journal
 
 PACKAGE_VERSION = '0.10.0'
 
+# Size of the shared DFU buffer at 0x20000018.
+BUFFER_SIZE = 0x3FC00 - 0x18
+
+# The modem only calculates digests of memory below this address.
+DIGEST_LIMIT = 0x1000000
+
+# FICR DEVICEID, 64 bit unique to every chip.
+FICR_DEVICEID = 0x00FF0204
+
+UUID_PATTERN = re.compile(r"^[0-9a-fA-F]{8}(-[0-9a-fA-F]{4}){3}-[0-9a-fA-F]{12}$")
+
+# Wait before the first retry of a failed chunk, doubled for every further retry.
+RETRY_DELAY = 0.1
+RETRY_DELAY_MAX = 2.0
+
 
 @enum.unique
 class NrfDfuErr(enum.IntEnum):
@@ -29,77 +54,182 @@ class NrfDfuErr(enum.IntEnum):
     NRFJPROG_ERRROR         = -100
 
 
+def _file_version(path):
+    """
+    :return size and modification time of the file, None if it does not exist:
+    """
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
 class nrf_dfu_API(object):
 
-    def __init__(self, quiet=False, verbose=False):
+    def __init__(self, quiet=False, verbose=False, api=None, image_cache_dir=None, journal_dir=None,
+                 wait_profiles=None, backoff=None, ipc_catalog=None, profile_dir=None, identity_cache=None):
+        """
+        :param api: probe backend implementing the pynrfjprog API interface,
+            e.g. sim_probe.SimulatedProbe. Defaults to pynrfjprog's NRF91 API.
+        :param image_cache_dir: directory for pre-processed firmware images,
+            defaults to firmware_image.DEFAULT_CACHE_DIR.
+        :param journal_dir: directory for update progress journals,
+            defaults to update_journal.DEFAULT_JOURNAL_DIR.
+        :param wait_profiles: dict of event_wait.WaitProfile per command,
+            overriding event_wait.DEFAULT_WAIT_PROFILES.
+        :param backoff: event_wait.Backoff polling schedule for event waits.
+        :param ipc_catalog: ipc_catalog.IpcCatalog to find the IPC DFU executable
+            in, instead of the current directory.
+        :param profile_dir: directory of the per probe tuning profiles,
+            defaults to tuning.DEFAULT_PROFILE_DIR.
+        :param identity_cache: identity_cache.IdentityCache to keep the UUID and
+            digests of the device up to date in.
+        """
         self._quiet = quiet
         self._verbose = verbose
-        self.api = API.API("NRF91")
+        self._image_cache_dir = image_cache_dir
+        self._journal_dir = journal_dir
+        self._journal = None
+        self._prepared = {}
+        self.failed_address = None
+        self.retries = 0
+        self._connect_options = {}
+        self._profile_dir = profile_dir
+        self.buffer_size = BUFFER_SIZE
+        self.snr = None
+        self.uuid = None
+        self.identity_cache = identity_cache
+        self.ipc_catalog = ipc_catalog
+        self.wait_profiles = dict(event_wait.DEFAULT_WAIT_PROFILES)
+        if wait_profiles is not None:
+            self.wait_profiles.update(wait_profiles)
+        if backoff is None:
+            backoff = event_wait.DEFAULT_BACKOFF
+        self.backoff = backoff
+        if api is None:
+            # pynrfjprog and the J-Link library are only loaded when a probe is used.
+            from pynrfjprog import API
+            api = API.API("NRF91")
+        self.api = api
+        # Backends with a virtual clock, like the simulator, provide their own time and sleep.
+        self._time = getattr(api, "time", time.time)
+        self._sleep = getattr(api, "sleep", time.sleep)
+        self.metrics = metrics.DfuMetrics(self._time)
 
     def init(self, snr=None, ipc_path=None):
-        self.api.open()
-        if (snr is not None):
-            self.api.connect_to_emu_with_snr(snr)
-        else:
-            self.api.connect_to_emu_without_snr()
-            self.api.sys_reset()
+        return_value = self._init_connect(snr)
+        if return_value < 0:
+            return return_value
+
+        with self.metrics.phase("root_key_digest_wait"):
+            if (not self._quiet):
+                print("Start polling IPC.MODEM_CTRL_EVENT to receive root key digest")
+            return_value = self.wait_for_event("boot")
+            if return_value < 0:
+                return return_value
+
+        return_value = self._init_program(ipc_path)
+        if return_value < 0:
+            return return_value
+
+        with self.metrics.phase("started_wait"):
+            if (not self._quiet):
+                print ("Start polling IPC.MODEM_CTRL_EVENT To receive 'Started' indication from DFU executable")
 
-        if (self.api.read_device_family == API.DeviceFamily.NRF91):
+            return_value = self.wait_for_event("started")
+            if return_value < 0:
+                return return_value
+
+        return self._init_started()
+
+    def _init_connect(self, snr):
+        """
+        Connects to the device, configures IPC and RAM for DFU and resets the modem.
+        """
+        # The UUID is read again from the device connected now.
+        self.uuid = None
+        with self.metrics.phase("connect"):
+            self.api.open()
+            if (snr is not None):
+                self._load_tuning(snr)
+                self.api.connect_to_emu_with_snr(snr, **self._connect_options)
+            else:
+                self.api.connect_to_emu_without_snr()
+                # The tuning profile is found by the serial number of the connected probe.
+                snr = self.api.read_connected_emu_snr()
+                if self._load_tuning(snr):
+                    self.api.disconnect_from_emu()
+                    self.api.connect_to_emu_with_snr(snr, **self._connect_options)
+                self.api.sys_reset()
+            self.snr = snr
+
+        # Only a pynrfjprog backend has a device family to check, and then
+        # pynrfjprog is loaded already. Other backends run without it.
+        API = sys.modules.get("pynrfjprog.API")
+        if (API is not None and self.api.read_device_family == API.DeviceFamily.NRF91):
             print("ERROR: Wrong device for tool, this tool is only available for NRF91 family")
             return NrfDfuErr.WRONG_FAMILY_FOR_TOOL
 
-        if (not self._quiet):
-            print("Configure APP IPC as non-secure")
-        self.api.write_u32(0x500038A8, 0x00000002, True)
+        if self.identity_cache is not None and self.snr is not None:
+            self._check_identity()
 
-        if (not self._quiet):
-            print("Configure IPC HW for DFU")
-        self.api.write_u32(0x4002A514, 0x00000002, True)
-        self.api.write_u32(0x4002A51C, 0x00000008, True)
-        self.api.write_u32(0x4002A610, 0x21000000, True)
-        self.api.write_u32(0x4002A614, 0x00000000, True)
-        self.api.write_u32(0x4002A590, 0x00000001, True)
-        self.api.write_u32(0x4002A598, 0x00000004, True)
-        self.api.write_u32(0x4002A5A0, 0x00000010, True)
-        self.acknowlage_events()
+        with self.metrics.phase("register_setup") as phase:
+            if (not self._quiet):
+                print("Configure APP IPC as non-secure")
+                print("Configure IPC HW for DFU")
+            phase["writes"] = register_script.run_script(self.api, register_script.IPC_SETUP)
+            self.acknowlage_events()
 
-        if (not self._quiet):
-            print ("Configure APP RAM as non-secure")
-        self.api.power_ram_all()
-        regidx = 32 * 4
-        ramregion_base = 0x50003700
+        with self.metrics.phase("ram_permissions") as phase:
+            if (not self._quiet):
+                print ("Configure APP RAM as non-secure")
+            self.api.power_ram_all()
 
-        while (regidx != 0):
-            regidx = regidx - 4
-            permreg = ramregion_base + regidx
-            self.api.write_u32(permreg, 0x00000007, True)
+            if (not self._quiet):
+                print("Store DFU indication into shared memory")
+            phase["writes"] = register_script.run_script(
+                self.api, register_script.RAM_PERMISSIONS + register_script.DFU_INDICATION)
 
-        if (not self._quiet):
-            print("Store DFU indication into shared memory")
-        self.api.write_u32(0x20000000, 0x80010000, True)
-        self.api.write_u32(0x20000004, 0x2100000C, True)
-        self.api.write_u32(0x20000008, 0x0003FC00, True)
+        with self.metrics.phase("modem_reset") as phase:
+            if (not self._quiet):
+                print("Power up / reset modem")
+            phase["writes"] = register_script.run_script(self.api, register_script.MODEM_RESET)
 
-        if (not self._quiet):
-            print("Power up / reset modem")
-        self.api.write_u32(0x50005610, 0x00000000, True)
-        self.api.write_u32(0x50005614, 0x00000001, True)
-        self.api.write_u32(0x50005610, 0x00000001, True)
-        self.api.write_u32(0x50005614, 0x00000000, True)
-        self.api.write_u32(0x50005610, 0x00000000, True)
+        return NrfDfuErr.SUCCESS
+
+    def _load_tuning(self, snr):
+        """
+        Selects the J-Link speed and chunk size found by tuning.calibrate for
+        the probe with serial number snr, or the defaults.
+
+        :return True if the probe has a tuning profile:
+        """
+        self._connect_options = {}
+        self.buffer_size = BUFFER_SIZE
+        profile = tuning.load_profile(snr, self._profile_dir)
+        if profile is None:
+            return False
 
         if (not self._quiet):
-            print("Start polling IPC.MODEM_CTRL_EVENT to receive root key digest")
-        start_time = time.time()
-        event_received = False
-        while (event_received == False):
-            if ((time.time() - start_time) > 10):
-                print ("ERROR: Time out, no event received after 10 sec.")
-                return NrfDfuErr.TIME_OUT
-            return_value, event_received = self.get_event_status()
-            if return_value < 0:
-                return return_value
+            print("Using tuning profile: %d kHz, chunk size %d" %
+                  (profile["jlink_speed_khz"], profile["chunk_size"]))
+        self._connect_options = {"jlink_speed_khz": profile["jlink_speed_khz"]}
+        self.buffer_size = min(profile["chunk_size"], BUFFER_SIZE)
+        return True
 
+    def _init_program(self, ipc_path):
+        """
+        Reads the root key digest and starts the matching IPC DFU executable.
+        """
+        return self._start_ipc_dfu(self._read_root_key_digest(), ipc_path)
+
+    def _read_root_key_digest(self):
+        """
+        Reads the modem root key digest sent after the modem reset.
+
+        :return root key digest as a hex string:
+        """
         self.acknowlage_events()
 
         return_value, modem_response = self.read_be(0x2000000C)
@@ -107,16 +237,22 @@ class nrf_dfu_API(object):
         if (not self._quiet):
             print ("Modem responded with %s" % modem_response)
 
-        digest = ""
-        for i in range(0x20000010, 0x20000030, 4):
-            return_value, lelevel = self.hex_read(i)
-            digest = digest + lelevel
-
+        # The digest bytes in memory order, in one block transfer.
+        digest = binascii.hexlify(bytearray(self.api.read(0x20000010, 32))).decode()
 
         if (not self._quiet):
             print ("Modem root key digest received: %s" % digest)
 
-        return_value = self.program(digest, ipc_path)
+        self._remember(root_key_digest=digest)
+
+        return digest
+
+    def _start_ipc_dfu(self, digest, ipc_path):
+        """
+        Programs the IPC DFU executable for the root key digest and starts it.
+        """
+        with self.metrics.phase("ipc_program"):
+            return_value = self.program(digest, ipc_path)
         if (return_value < 0):
             return return_value
         if (not self._quiet):
@@ -124,19 +260,9 @@ class nrf_dfu_API(object):
             print ("Send IPC.APP_CTRL_TASK")
         self.api.write_u32(0x4002A004, 0x00000001, False)
 
-        if (not self._quiet):
-            print ("Start polling IPC.MODEM_CTRL_EVENT To receive 'Started' indication from DFU executable")
-
-        start_time = time.time()
-        event_received = False
-        while (event_received == False):
-            if ((time.time() - start_time) > 10):
-                print ("ERROR: Time out, no event received after 10 sec.")
-                return NrfDfuErr.TIME_OUT
-            return_value, event_received = self.get_event_status()
-            if return_value < 0:
-                return return_value
+        return NrfDfuErr.SUCCESS
 
+    def _init_started(self):
         self.acknowlage_events()
 
         if (not self._quiet):
@@ -147,20 +273,48 @@ class nrf_dfu_API(object):
         return NrfDfuErr.SUCCESS
 
 
+    def wait_for_event(self, command, nbytes=0):
+        """
+        Waits for the modem to signal the end of an operation.
+
+        Polls the IPC events with the backoff schedule, the expected duration
+        and timeout come from the wait profile of the command.
+
+        :param command: key into self.wait_profiles, e.g. "write".
+        :param nbytes: number of bytes handled by the operation.
+        :return NrfDfuErr:
+        """
+        profile = self.wait_profiles[command]
+        for delay in event_wait.poll_delays(profile, self.backoff, self._time, nbytes):
+            if delay > 0:
+                self._sleep(delay)
+            return_value, event_received = self.get_event_status()
+            if return_value < 0:
+                return return_value
+            if event_received:
+                return NrfDfuErr.SUCCESS
+
+        print ("ERROR: Time out, no event received after %.1f sec." % profile.timeout(nbytes))
+        return NrfDfuErr.TIME_OUT
+
     def get_event_status(self):
+        self.metrics.polls += 1
 
-        fault_event_detected = self.api.read(0x4002A100,4)
-        command_event_detected = self.api.read(0x4002A108,4)
-        data_event_detected = self.api.read(0x4002A110,4)
+        # One block transfer covering the fault (0x100), command (0x108)
+        # and data (0x110) events.
+        events = self.api.read(0x4002A100, 0x14)
+        fault_event_detected = events[0]
+        command_event_detected = events[8]
+        data_event_detected = events[16]
 
-        if (fault_event_detected[0] != 0):
-            print("Fault detected. Error Code: {}".format(fault_event_detected[0]))
+        if (fault_event_detected != 0):
+            print("Fault detected. Error Code: {}".format(fault_event_detected))
             event_received = True
             return (NrfDfuErr.DFU_ERROR, event_received)
-        elif (command_event_detected[0] != 0):
+        elif (command_event_detected != 0):
             event_received = True
             return (NrfDfuErr.SUCCESS, event_received)
-        elif (data_event_detected[0] != 0):
+        elif (data_event_detected != 0):
             event_received = True
             return (NrfDfuErr.SUCCESS, event_received)
         else:
@@ -184,6 +338,28 @@ class nrf_dfu_API(object):
 
         return (NrfDfuErr.SUCCESS, lelevel)
 
+    def _check_response(self, failure="ERROR: Program failed at %s"):
+        """
+        Acknowledges the events and checks the modem response to the last command.
+
+        :param failure: message printed with the failing address on COMMAND ERROR.
+        :return NrfDfuErr:
+        """
+        self.acknowlage_events()
+
+        return_value, modem_response = self.read_be(0x2000000C)
+
+        if (modem_response == "5a000001"):
+            print("\n\n ERROR: UNKNOWN COMMAND")
+            return NrfDfuErr.DFU_ERROR
+        elif (modem_response == "5a000002"):
+            print("\n\n ERROR: COMMAND ERROR")
+            error_result = self.api.read_u32(0x20000010)
+            print(failure % hex(error_result))
+            return NrfDfuErr.DFU_ERROR
+
+        return NrfDfuErr.SUCCESS
+
     def acknowlage_events(self):
 
         self.api.write_u32(0x4002A100, 0, False)
@@ -194,11 +370,21 @@ class nrf_dfu_API(object):
 
 
     def program(self, modem_digest, path=None):
-
         # Parse the hex file with the help of the HEX module
         if path is not None:
+            from pynrfjprog import Hex
             test_program = Hex.Hex(path[0])
+        elif self.ipc_catalog is not None:
+            image = self.ipc_catalog.lookup(modem_digest)
+            if image is None:
+                print("ERROR: cant find: "+modem_digest[0:7]+".ipc_dfu.signed.ihex in "+self.ipc_catalog.directory)
+                print("ERROR: Missing correct ipc_dfu for current verison.")
+                return NrfDfuErr.MISSING_IPC_FILE
+            for address, data in image.segment_data():
+                self.api.write(address, data, False)
+            return NrfDfuErr.SUCCESS
         else:
+            from pynrfjprog import Hex
             try:
                 test_program = Hex.Hex(modem_digest[0:7].upper()+".ipc_dfu.signed.ihex")
             except:
@@ -212,96 +398,406 @@ class nrf_dfu_API(object):
 
         return NrfDfuErr.SUCCESS
 
-    def update_firmware(self, hex_file_path):
-        firmware_start = time.time()
-        if (not self._quiet):
-            print("Updating modem firmware")
-
-        buffer_size=0x3FC00 - 0x18
-        test_program = Hex.Hex(hex_file_path)
-        program_start = time.time()
+    def update_firmware(self, hex_file_path, delta=False, journal=False, resume=False,
+                        skip_blank=False, verify_chunks=False, retries=0):
+        """
+        Programs the firmware update image into the modem.
+
+        :param delta: only program the pages that differ from the image,
+            found by comparing modem calculated digests with the image.
+            Chunks at or above DIGEST_LIMIT are always written.
+        :param journal: record every chunk confirmed by the modem in a journal
+            keyed by the device and the image. The journal is removed by a
+            successful verify_update.
+        :param resume: continue from the first chunk not confirmed in the
+            journal of a previous, interrupted update. Implies journal.
+        :param skip_blank: erase the pages that are entirely 0xFF in the image
+            instead of transferring and writing them.
+        :param verify_chunks: check every chunk against a modem calculated
+            digest right after programming it, and stop at the first chunk
+            that does not match. The failing page address is kept in
+            self.failed_address. Chunks at or above DIGEST_LIMIT are not
+            checked, as in verify_update.
+        :param retries: number of times a chunk that failed to program is
+            retried, see _retry_chunk. The number of retries made is kept
+            in self.retries.
+        """
+        image, plan, erases = self._begin_update(hex_file_path, skip_blank)
+        program_start = self._time()
 
-        for segment in test_program:
-            data = []
-            address = segment.address
-            length = len(segment.data)
-            max_length = len(segment.data)
-            start = 0
-            if (not self._quiet):
-                print("Programming pages from address %s" % hex(address))
-            if (length > buffer_size - 1):
-                end = buffer_size
-                length = end - start
-            else:
-                end = length
-
-            while True:
-                if (address % 8192 != 0):
-                    if (not self._quiet):
-                        print("address missalignement")
-                    length += (address % 8192)
-                    address = address - (address % 8192)
-                    if (not self._quiet):
-                        print ("Address aligned to {}".format(address))
-                    data = [0xFF]*(address % 8192)
-
-                data += segment.data[start:end]
-
-                if (length % 8192 != 0):
-                    length += (length % 8192)
-                    data += [0xFF] * (length % 8192)
-
-                self.api.write(0x20000018, data, False)
-                self.api.write_u32(0x20000010, address, False)
-                self.api.write_u32(0x20000014, length, False)
-                self.api.write_u32(0x4002A100, 1, False)
-
-                #initiate write
-                self.api.write_u32(0x2000000C, 0x00000003, True)
-                self.api.write_u32(0x4002A004, 0x00000001, False)
-
-                start_time = time.time()
-                event_received = False
-                while (event_received == False):
-                    if ((time.time() - start_time) > 10):
-                        print ("ERROR: Time out, no event received after 10 sec.")
-                        return NrfDfuErr.TIME_OUT
-                    return_value, event_received = self.get_event_status()
+        self._journal = None
+        if journal or resume:
+            return_value, device_id = self.device_id()
+            if return_value < 0:
+                return return_value
+            self._journal = update_journal.UpdateJournal(device_id, image.sha256, self._journal_dir)
+            confirmed = self._journal.confirmed() if resume else []
+
+            # Skip the chunks confirmed in order at the start of the plan.
+            done = 0
+            while (done < len(plan) and done < len(confirmed)
+                   and (plan[done].address, plan[done].length) == confirmed[done]):
+                done += 1
+            if (not self._quiet) and resume:
+                print("Resuming update, %d of %d chunks already programmed" % (done, len(plan)))
+            if done < len(confirmed) or not resume:
+                self._journal.remove()
+                for op in plan[:done]:
+                    self._journal.record(op.address, op.length)
+            plan = plan[done:]
+
+        with self.metrics.phase("program") as phase:
+            phase["bytes"] = sum(op.length for op in plan)
+            phase["blank_bytes"] = self.blank_stats["bytes"]
+            progress = self.metrics.progress("program", phase["bytes"])
+            for address, length in erases:
+                return_value = self.partial_erase(address, length)
+                if return_value < 0:
+                    return return_value
+
+            for address, length, data in plan:
+                if (not self._quiet):
+                    print("Programming pages from address %s" % hex(address))
+                # Chunks the modem cannot calculate a digest of are written as they are.
+                digest = address + length <= DIGEST_LIMIT
+                write = self._write_chunk_delta if delta and digest else self._write_chunk
+                return_value = self._retry_chunk(write, address, length, data, retries)
+                phase["retries"] = self.retries
+                if return_value < 0:
+                    return return_value
+                if verify_chunks and digest:
+                    return_value = self._verify_chunk(address, length, data)
                     if return_value < 0:
                         return return_value
+                if self._journal is not None:
+                    self._journal.record(address, length)
+                progress.advance(address, length, self.timing["modem_wait"])
 
-                self.acknowlage_events()
+        self._end_update(program_start, delta, skip_blank)
+        return NrfDfuErr.SUCCESS
 
-                return_value, modem_response = self.read_be(0x2000000C)
+    def _begin_update(self, hex_file_path, skip_blank=False):
+        """
+        Resets the update state and statistics and plans the update.
 
-                if (modem_response == "5a000001"):
-                    print("\n\n ERROR: UNKNOWN COMMAND")
-                    return NrfDfuErr.DFU_ERROR
-                elif (modem_response == "5a000002"):
-                    print("\n\n ERROR: COMMAND ERROR")
-                    error_result = self.api.read_u32(0x20000010)
-                    print("Program failed at {}".format(hex(error_result)))
-                    return NrfDfuErr.DFU_ERROR
+        :return tuple of FirmwareImage, list of WriteOp and list of (address, length) erases:
+        """
+        self._update_start = self._time()
+        if (not self._quiet):
+            print("Updating modem firmware")
 
-                if (length < buffer_size - 1):
-                    break
-                else:
-                    start = start + length
-                    address =  address +length
-                    if end + length >= max_length:
-                        end = max_length
-                    else:
-                        end = end + length
-
-        program_end = time.time()
+        self.timing = {"prepare": 0.0, "transfer": 0.0, "modem_wait": 0.0}
+        self.delta_stats = {"total": 0, "skipped": 0, "erased": 0}
+        self.blank_stats = {"bytes": 0, "erases": 0}
+        self.failed_address = None
+        self.retries = 0
+        # The firmware digest is only known again after verify_update.
+        self._remember(fw_digest=None)
+        # Preparing the image is host work, timed with the host clock.
+        prepare_start = time.time()
+        image, plan = self._prepared_update(hex_file_path)
+        erases = []
+        if skip_blank:
+            plan, erases = chunk_planner.plan_update(image.blocks(), self.buffer_size)
+            self.blank_stats = {"bytes": sum(length for address, length in erases), "erases": len(erases)}
+        self.timing["prepare"] = time.time() - prepare_start
+        return image, plan, erases
+
+    def _end_update(self, program_start, delta=False, skip_blank=False):
+        """
+        Prints the statistics of a finished update.
+        """
+        program_end = self._time()
         if (not self._quiet):
+            if delta:
+                print ("Delta update: %d of %d bytes already up to date, %d bytes erased" %
+                       (self.delta_stats["skipped"], self.delta_stats["total"], self.delta_stats["erased"]))
+            if skip_blank:
+                print ("Blank pages: %d bytes erased with %d commands instead of written" %
+                       (self.blank_stats["bytes"], self.blank_stats["erases"]))
             print ("Programing firmware time: %f" % (program_end - program_start))
-        fimrware_end = time.time()
+            print ("Chunk preparation: %f, transfer: %f, modem busy: %f" %
+                   (self.timing["prepare"], self.timing["transfer"], self.timing["modem_wait"]))
+        fimrware_end = self._time()
         if (not self._quiet):
-            print ("Firmware update time including overhead: %f" % (fimrware_end - firmware_start))
+            print ("Firmware update time including overhead: %f" % (fimrware_end - self._update_start))
             print ("Firmware updated.")
+
+    def prepare_update(self, hex_file_path):
+        """
+        Starts loading and planning the firmware update image in a background
+        thread, so it is ready when init has finished.
+
+        update_firmware and verify_update use the prepared image when called
+        with the same hex_file_path, as long as the file has not changed.
+        """
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self._prepared[hex_file_path] = (_file_version(hex_file_path),
+                                         executor.submit(self._prepare, hex_file_path))
+        executor.shutdown(wait=False)
+
+    def _prepare(self, hex_file_path):
+        image = firmware_image.load_image(hex_file_path, self._image_cache_dir)
+        plan = chunk_planner.plan_chunks(image.blocks(), BUFFER_SIZE)
+        return image, plan
+
+    def _prepared_update(self, hex_file_path):
+        """
+        :return tuple of FirmwareImage and list of WriteOp for hex_file_path:
+        """
+        version = _file_version(hex_file_path)
+        version_prepared, future = self._prepared.get(hex_file_path, (None, None))
+        if future is None or version_prepared != version:
+            # Not prepared yet, or the file was replaced since.
+            future = concurrent.futures.Future()
+            future.set_result(self._prepare(hex_file_path))
+            self._prepared[hex_file_path] = (version, future)
+        try:
+            image, plan = future.result()
+        except Exception:
+            # The background preparation failed, it is not kept for the next call.
+            self._prepared.pop(hex_file_path, None)
+            raise
+        if self.buffer_size != BUFFER_SIZE:
+            # A tuning profile selected a smaller chunk size.
+            plan = chunk_planner.plan_chunks(image.blocks(), self.buffer_size)
+        return image, plan
+
+    def _retry_chunk(self, write, address, length, data, retries):
+        """
+        Programs a chunk with write, retrying it when it fails.
+
+        A probe error, an event timeout or a command error is followed by a
+        wait of RETRY_DELAY, doubled for every retry up to RETRY_DELAY_MAX,
+        and a link check: the probe is reconnected after a probe error and
+        the DFU executable must answer a UUID command. Only then the chunk
+        is written again.
+
+        :return NrfDfuErr of the last attempt:
+        """
+        attempt = 0
+        probe_error = False
+        while True:
+            if attempt > 0:
+                # After a timeout the modem may still be programming the chunk.
+                busy_length = length if return_value == NrfDfuErr.TIME_OUT else 0
+                return_value = self._recover(probe_error, busy_length)
+                probe_error = return_value == NrfDfuErr.NRFJPROG_ERRROR
+            if attempt == 0 or return_value >= 0:
+                try:
+                    return_value = write(address, length, data)
+                except self._probe_errors() as e:
+                    print("ERROR: Probe error while programming %s: %s" % (hex(address), e))
+                    return_value = NrfDfuErr.NRFJPROG_ERRROR
+                    probe_error = True
+            if return_value >= 0 or attempt >= retries:
+                return return_value
+
+            attempt += 1
+            self.retries += 1
+            self.metrics.record("chunk_retry", address=address, attempt=attempt, result=int(return_value))
+            delay = min(RETRY_DELAY * 2 ** (attempt - 1), RETRY_DELAY_MAX)
+            if (not self._quiet):
+                print("Retrying chunk at %s in %.1f s, attempt %d of %d" % (hex(address), delay, attempt, retries))
+            self._sleep(delay)
+
+    def _recover(self, reconnect, busy_length=0):
+        """
+        Checks that the DFU executable still answers after a failed command,
+        reconnecting to the probe first if reconnect is set.
+
+        When busy_length is set, the write of that many bytes may still be
+        running after a timeout. Its event is awaited first, so it is not
+        taken for the answer to the check. The answer must be the UUID of
+        the device, and it is not stored in the identity cache.
+
+        :return NrfDfuErr, NRFJPROG_ERRROR if the probe failed:
+        """
+        try:
+            if reconnect:
+                if (not self._quiet):
+                    print("Reconnecting to the probe")
+                try:
+                    self.api.disconnect_from_emu()
+                except self._probe_errors():
+                    pass
+                if self.snr is not None:
+                    self.api.connect_to_emu_with_snr(self.snr, **self._connect_options)
+                else:
+                    self.api.connect_to_emu_without_snr()
+            if busy_length:
+                # The modem may never finish the write, so a timeout here is not an error.
+                self.wait_for_event("write", busy_length)
+            self.acknowlage_events()
+            return_value, uuid = self._read_uuid(remember=False)
+        except self._probe_errors() as e:
+            print("ERROR: Probe error while checking the DFU executable: %s" % e)
+            return NrfDfuErr.NRFJPROG_ERRROR
+        if return_value < 0:
+            return return_value
+
+        uuid = ''.join(uuid).strip("\x00")
+        if self.uuid is not None:
+            answered = uuid == self.uuid
+        else:
+            answered = UUID_PATTERN.match(uuid) is not None
+        if not answered:
+            print("ERROR: The DFU executable did not answer the UUID command")
+            return NrfDfuErr.DFU_ERROR
+
         return NrfDfuErr.SUCCESS
 
+    def _probe_errors(self):
+        """
+        Other exceptions, like programming errors, are not retried.
+
+        :return tuple of the exception types raised by failed probe calls:
+        """
+        errors = []
+        # pynrfjprog is loaded by the probe API, if a probe is used at all.
+        api_error = sys.modules.get("pynrfjprog.APIError")
+        if api_error is not None:
+            errors.append(api_error.APIError)
+        # Other backends, like the simulator, name their own error type.
+        error_type = getattr(self.api, "error_type", None)
+        if isinstance(error_type, type) and issubclass(error_type, Exception):
+            errors.append(error_type)
+        return tuple(errors)
+
+    def _write_chunk_delta(self, address, length, data):
+        """
+        Programs only the pages of a chunk that differ from the modem flash.
+
+        Differing pages are found by bisecting the chunk with digest commands.
+        Pages that are entirely 0xFF in the image are erased instead of written.
+        """
+        data = data[:length]
+        self.delta_stats["total"] += len(data)
+
+        pages = []
+        return_value = self._find_changed_pages(address, data, pages)
+        if return_value < 0:
+            return return_value
+
+        self.delta_stats["skipped"] += len(data) - sum(len(page) for page_address, page in pages)
+
+        # Merge neighbouring pages into as few commands as possible.
+        blank_page = b"\xff" * 8192
+        runs = []
+        for page_address, page in pages:
+            blank = page == blank_page
+            if runs and runs[-1][2] == blank and runs[-1][0] + len(runs[-1][1]) == page_address:
+                runs[-1][1] += page
+            else:
+                runs.append([page_address, bytearray(page), blank])
+
+        for run_address, run_data, blank in runs:
+            if blank:
+                return_value = self.partial_erase(run_address, len(run_data))
+                self.delta_stats["erased"] += len(run_data)
+            else:
+                return_value = self._write_chunk(run_address, len(run_data), bytes(run_data))
+            if return_value < 0:
+                return return_value
+
+        return NrfDfuErr.SUCCESS
+
+    def _verify_chunk(self, address, length, data):
+        """
+        Compares a programmed chunk with the digest calculated by the modem.
+
+        On a mismatch the first differing page is found by bisection, stored
+        in self.failed_address and recorded in the metrics.
+        """
+        data = data[:length]
+        with self.metrics.phase("chunk_verify") as phase:
+            phase["bytes"] = length
+            return_value = self.calculate_digest([(address, length)])
+            if return_value < 0:
+                return return_value
+            if self._read_digest().upper() == hashlib.sha256(data).hexdigest().upper():
+                return NrfDfuErr.SUCCESS
+
+            pages = []
+            return_value = self._find_changed_pages(address, data, pages)
+            if return_value < 0:
+                return return_value
+
+        self.failed_address = pages[0][0] if pages else address
+        self.metrics.record("verify_failure", address=self.failed_address)
+        print("ERROR: Verification failed at %s" % hex(self.failed_address))
+        return NrfDfuErr.DFU_ERROR
+
+    def _find_changed_pages(self, address, data, pages):
+        """
+        Appends the (address, data) of every page in the range that does not
+        match the modem flash to pages.
+        """
+        return_value = self.calculate_digest([(address, len(data))])
+        if return_value < 0:
+            return return_value
+
+        if self._read_digest().upper() == hashlib.sha256(data).hexdigest().upper():
+            return NrfDfuErr.SUCCESS
+
+        page_count = (len(data) + 8191) // 8192
+        if page_count == 1:
+            pages.append((address, data))
+            return NrfDfuErr.SUCCESS
+
+        split = (page_count // 2) * 8192
+        return_value = self._find_changed_pages(address, data[:split], pages)
+        if return_value < 0:
+            return return_value
+        return self._find_changed_pages(address + split, data[split:], pages)
+
+    def _write_chunk(self, address, length, data):
+        """
+        Transfers one chunk to the shared DFU buffer and lets the modem program it.
+        """
+        chunk = self._start_chunk(address, length, data)
+        return self._finish_chunk(chunk, self.wait_for_event("write", length))
+
+    def _start_chunk(self, address, length, data):
+        """
+        Transfers one chunk to the shared DFU buffer and starts programming it.
+
+        :return state of the chunk for _finish_chunk:
+        """
+        transfer_start = self._time()
+        self._start_write(address, length, data)
+
+        wait_start = self._time()
+        self.timing["transfer"] += wait_start - transfer_start
+        return {"address": address, "bytes": length, "transfer": wait_start - transfer_start,
+                "wait_start": wait_start, "polls": self.metrics.polls}
+
+    def _finish_chunk(self, chunk, return_value):
+        """
+        Records the chunk and checks the modem response, once the wait for
+        the write event returned return_value.
+
+        :return NrfDfuErr:
+        """
+        if return_value < 0:
+            return return_value
+        wait_end = self._time()
+        self.timing["modem_wait"] += wait_end - chunk["wait_start"]
+        self.metrics.record("chunk", address=chunk["address"], bytes=chunk["bytes"], transfer=chunk["transfer"],
+                            modem_wait=wait_end - chunk["wait_start"], polls=self.metrics.polls - chunk["polls"])
+
+        return self._check_response("Program failed at %s")
+
+    def _start_write(self, address, length, data):
+        self.api.write(0x20000018, data, False)
+        self.api.write_u32(0x20000010, address, False)
+        self.api.write_u32(0x20000014, length, False)
+        self.api.write_u32(0x4002A100, 1, False)
+
+        #initiate write
+        self.api.write_u32(0x2000000C, 0x00000003, True)
+        self.api.write_u32(0x4002A004, 0x00000001, False)
+
     def partial_erase(self, address, length):
         if (not self._quiet):
             print("Erasing pages from address %s" % hex(address))
@@ -316,87 +812,55 @@ class nrf_dfu_API(object):
             print ("ERROR: Length can not be 0")
             return NrfDfuErr.INVALID_PARAMETER
 
-        self.api.write_u32(0x20000010, address, False)
-        self.api.write_u32(0x20000014, length, False)
+        with self.metrics.phase("erase") as phase:
+            phase["bytes"] = length
+            self._start_erase(address, length)
 
-        self.api.write_u32(0x2000000C, 0x00000002, False)
-        self.api.write_u32(0x4002A004, 0x00000001, False)
-
-        start_time = time.time()
-        event_received = False
-        while (event_received == False):
-            if ((time.time() - start_time) > 10):
-                print ("ERROR: Time out, no event received after 10 sec.")
-                return NrfDfuErr.TIME_OUT
-            return_value, event_received = self.get_event_status()
+            return_value = self.wait_for_event("erase", length)
             if return_value < 0:
                 return return_value
 
-        self.acknowlage_events()
-
-        return_value, modem_response = self.read_be(0x2000000C)
-
-        if (modem_response == "5a000001"):
-            print("\n\n ERROR: UNKNOWN COMMAND")
-            return NrfDfuErr.DFU_ERROR
-        elif (modem_response == "5a000002"):
-            print("\n\n ERROR: COMMAND ERROR")
-            error_result = self.api.read_u32(0x20000010)
-            print("ERROR: Program failed at %s" % hex(error_result))
-            return NrfDfuErr.DFU_ERROR
+            return_value = self._check_response()
+        if return_value < 0:
+            return return_value
 
         if (not self._quiet):
             print("Erasing pages complete.")
 
         return NrfDfuErr.SUCCESS
 
+    def _start_erase(self, address, length):
+        self.api.write_u32(0x20000010, address, False)
+        self.api.write_u32(0x20000014, length, False)
+
+        self.api.write_u32(0x2000000C, 0x00000002, False)
+        self.api.write_u32(0x4002A004, 0x00000001, False)
+
     def verify_update(self, hex_file_path, fw_digest_path):
         if (not self._quiet):
             print ("Starting verification")
         address = []
         length = []
 
-        test_program = Hex.Hex(hex_file_path)
-
-        for segment in test_program:
-            if segment.address < 0x1000000:
-                address.append(segment.address)
-                length.append(len(segment.data))
-
-        self.api.write_u32(0x2000000C, 0x00000007, True)
-        self.api.write_u32(0x20000010, len(address), False)
-
-        for n in range(0, len(address)):
-            self.api.write_u32(0x20000014+(n*8), address[n], False)
-            self.api.write_u32(0x20000018+(n*8), length[n], False)
+        image, plan = self._prepared_update(hex_file_path)
 
-        self.api.write_u32(0x4002A004, 0x00000001, False)
+        for segment_address, segment_length in image.segments:
+            if segment_address < DIGEST_LIMIT:
+                address.append(segment_address)
+                length.append(segment_length)
 
-        start_time = time.time()
-        event_received = False
-        while (event_received == False):
-            if ((time.time() - start_time) > 10):
-                print ("ERROR: Time out, no event received after 10 sec.")
-                return NrfDfuErr.TIME_OUT
-            return_value, event_received = self.get_event_status()
+        with self.metrics.phase("verify") as phase:
+            phase["bytes"] = sum(length)
+            return_value = self.calculate_digest(list(zip(address, length)))
             if return_value < 0:
                 return return_value
 
-        self.acknowlage_events()
-
-        return_value, modem_response = self.read_be(0x2000000C)
-
-        #print ("Modem responded with %s" % modem_response)
-
-        if (modem_response == "5a000001"):
-            print("\n\n ERROR: UNKNOWN COMMAND")
-            return NrfDfuErr.DFU_ERROR
-        elif (modem_response == "5a000002"):
-            print("\n\n ERROR: COMMAND ERROR")
-            error_result = self.api.read_u32(0x20000010)
-            print("ERROR: Program failed at %s" % hex(error_result))
-            return NrfDfuErr.DFU_ERROR
+        return self._match_digest(fw_digest_path)
 
+    def _match_digest(self, fw_digest_path):
+        """
+        Compares the digest calculated by the modem with the expected digest file.
+        """
         return_value, digest = self.read_digest()
         datafile = open(fw_digest_path)
         for line in datafile:
@@ -413,10 +877,52 @@ class nrf_dfu_API(object):
                 print("Verification failed")
             return NrfDfuErr.DFU_ERROR
         else:
+            if self._journal is not None:
+                self._journal.remove()
+                self._journal = None
+            self._remember(fw_digest=digest)
             return NrfDfuErr.SUCCESS
 
 
+    def calculate_digest(self, ranges):
+        """
+        Lets the modem calculate the digest of a list of memory ranges.
+
+        The digest is left in shared memory, read it with read_digest.
+
+        :param ranges: list of (address, length) tuples.
+        :return NrfDfuErr:
+        """
+        self._start_digest(ranges)
+
+        return_value = self.wait_for_event("digest", sum(r[1] for r in ranges))
+        if return_value < 0:
+            return return_value
+
+        return self._check_response()
+
+    def _start_digest(self, ranges):
+        self.api.write_u32(0x2000000C, 0x00000007, True)
+        self.api.write_u32(0x20000010, len(ranges), False)
+
+        for n in range(0, len(ranges)):
+            self.api.write_u32(0x20000014+(n*8), ranges[n][0], False)
+            self.api.write_u32(0x20000018+(n*8), ranges[n][1], False)
+
+        self.api.write_u32(0x4002A004, 0x00000001, False)
+
     def read(self, address, length, hex_file_path):
+        """
+        Reads modem memory into a file.
+
+        The memory is read in chunks that fit the shared DFU buffer, each
+        chunk is fetched with one block transfer and streamed to the file.
+
+        :param address: start address as a hex string.
+        :param length: number of bytes as a hex string, a multiple of 4.
+        :param hex_file_path: output file, raw binary if it ends with .bin,
+            Intel HEX otherwise.
+        """
 
         if ((int(length, 16) % 4) != 0):
             print("ERROR: number of bytes must be a multiple of 4")
@@ -425,50 +931,55 @@ class nrf_dfu_API(object):
         if (not self._quiet):
             print("Reading %s bytes from address %s" % (length, address))
 
-        open(hex_file_path, 'w+')
-        ih = IntelHex(hex_file_path)
-        ih.__init__()
-
-        self.api.write_u32(0x2000000C, 0x00000004, True)
-        self.api.write_u32(0x20000010, int(address, 16), False)
-        self.api.write_u32(0x20000014, int(length, 16), False)
+        # BUFFER_SIZE, or the chunk size of the tuning profile of the probe.
+        chunk_size = self.buffer_size
+        address = int(address, 16)
+        end = address + int(length, 16)
+        with self.metrics.phase("read") as phase:
+            phase["bytes"] = end - address
+            progress = self.metrics.progress("read", phase["bytes"])
+            writer = dump_writer.open_writer(hex_file_path)
+            try:
+                while address < end:
+                    count = min(chunk_size, end - address)
+                    return_value, data = self._read_chunk(address, count)
+                    if return_value < 0:
+                        return return_value
+                    writer.write(address, data)
+                    progress.advance(address, count)
+                    address += count
+            finally:
+                writer.close()
 
-        self.api.write_u32(0x4002A004, 0x00000001, False)
+        if (not self._quiet):
+            print ("Reading completed")
 
-        start_time = time.time()
-        event_received = False
-        while (event_received == False):
-            if ((time.time() - start_time) > 10):
-                print ("ERROR: Time out, no event received after 10 sec.")
-                return NrfDfuErr.TIME_OUT
-            return_value, event_received = self.get_event_status()
-            if return_value < 0:
-                return return_value
+        return NrfDfuErr.SUCCESS
 
-        self.acknowlage_events()
+    def _read_chunk(self, address, length):
+        """
+        Lets the modem copy memory to the shared DFU buffer and reads it back.
 
-        return_value, modem_response = self.read_be(0x2000000C)
+        :return tuple of NrfDfuErr type and bytes read:
+        """
+        self._start_read(address, length)
 
-        if (modem_response == "5a000001"):
-            print("\n\n ERROR: UNKNOWN COMMAND")
-            return NrfDfuErr.DFU_ERROR
-        elif (modem_response == "5a000002"):
-            print("\n\n ERROR: COMMAND ERROR")
-            error_result = self.api.read_u32(0x20000010)
-            print("ERROR: Read failed at {}".format(hex(error_result)))
-            return NrfDfuErr.DFU_ERROR
+        return_value = self.wait_for_event("read", length)
+        if return_value < 0:
+            return return_value, b""
 
-        word_count = int(length, 16)//4
+        return_value = self._check_response("ERROR: Read failed at %s")
+        if return_value < 0:
+            return return_value, b""
 
-        for i in range(0, word_count):
-            return_value, lelevel = self.hex_read(0x20000010+(i*4))
-            ih.puts(int(address,16)+(i*4), codecs.decode(lelevel, "hex"))
+        return NrfDfuErr.SUCCESS, bytes(self.api.read(0x20000010, length))
 
-        ih.write_hex_file(hex_file_path)
-        if (not self._quiet):
-            print ("Reading completed")
+    def _start_read(self, address, length):
+        self.api.write_u32(0x2000000C, 0x00000004, True)
+        self.api.write_u32(0x20000010, address, False)
+        self.api.write_u32(0x20000014, length, False)
 
-        return NrfDfuErr.SUCCESS
+        self.api.write_u32(0x4002A004, 0x00000001, False)
 
     def read_uuid(self):
         """
@@ -478,39 +989,56 @@ class nrf_dfu_API(object):
         """
         if (not self._quiet):
             print("UUID reading started")
+
+        return_value, a = self._read_uuid()
+        if return_value < 0:
+            return return_value, ""
+        print (''.join(a))
+
+        return NrfDfuErr.SUCCESS, a
+
+    def _read_uuid(self, remember=True):
+        """
+        :param remember: store the UUID as the identity of the device.
+        :return tuple of NrfDfuErr type and list of UUID characters:
+        """
+        self._start_uuid()
+
+        return_value = self.wait_for_event("uuid")
+        if return_value < 0:
+            return return_value, ""
+
+        return_value = self._check_response("ERROR: Read failed at %s")
+        if return_value < 0:
+            return return_value, ""
+
+        return NrfDfuErr.SUCCESS, self._uuid_result(remember)
+
+    def _start_uuid(self):
         self.api.write_u32(0x2000000C, 0x00000008, True)
 
         self.api.write_u32(0x4002A004, 0x00000001, False)
-        start_time = time.time()
-        event_received = False
-        while (event_received == False):
-            if ((time.time() - start_time) > 10):
-                print ("ERROR: Time out, no event received after 10 sec.")
-                return NrfDfuErr.TIME_OUT, ""
-            return_value, event_received = self.get_event_status()
-            if return_value < 0:
-                return return_value, ""
 
-        self.acknowlage_events()
+    def _uuid_result(self, remember=True):
+        # The 36 UUID characters in one block transfer.
+        a = [chr(c) for c in bytearray(self.api.read(0x20000010, 36))]
+        if remember:
+            self.uuid = ''.join(a).strip("\x00")
+            self._remember(uuid=self.uuid)
 
-        return_value, modem_response = self.read_be(0x2000000C)
+        return a
 
-        if (modem_response == "5a000001"):
-            print("\n\n ERROR: UNKNOWN COMMAND")
-            return NrfDfuErr.DFU_ERROR, ""
-        elif (modem_response == "5a000002"):
-            print("\n\n ERROR: COMMAND ERROR")
-            error_result = self.api.read_u32(0x20000010)
-            print("ERROR: Read failed at %s" % hex(error_result))
-            return NrfDfuErr.DFU_ERROR, ""
+    def device_id(self):
+        """
+        Identifies the connected device by probe serial number and modem UUID.
 
-        a = []
-        for i in range(0, 9):
-            for n in (0, 8, 16, 24):
-                a.append(chr(int(hex(int(self.api.read_u32(0x20000010 + (i * 4))) >> n & 0xff), 16)))
-        print (''.join(a))
+        :return tuple of NrfDfuErr type and device id string:
+        """
+        return_value, uuid = self._read_uuid()
+        if return_value < 0:
+            return return_value, ""
 
-        return NrfDfuErr.SUCCESS, a
+        return NrfDfuErr.SUCCESS, "%d-%s" % (self.api.read_connected_emu_snr(), ''.join(uuid).strip("\x00"))
 
     def read_digest(self):
         """
@@ -521,10 +1049,7 @@ class nrf_dfu_API(object):
         if not self._quiet:
             print("Digest reading started")
 
-        digest = ""
-        for i in range(0x20000010, 0x20000030, 4):
-            return_value, belevel = self.read_be(i)
-            digest = digest + belevel
+        digest = self._read_digest()
 
         if not self._quiet:
             print("Firmware digest received from modem: %s" % digest)
@@ -532,6 +1057,74 @@ class nrf_dfu_API(object):
         # Return hardcoded NrfDfuErr.SUCCESS due to self.read_be always returns NrfDfuErr.SUCCESS
         return NrfDfuErr.SUCCESS, digest
 
+    def _read_digest(self):
+        # One block transfer, every word printed as a big endian value.
+        words = struct.unpack("<8I", bytes(bytearray(self.api.read(0x20000010, 32))))
+        return "".join("%08x" % word for word in words)
+
+    def read_identity(self, snr=None, ipc_path=None, refresh=False):
+        """
+        Returns the identity of the device: its UUID, root key digest and the
+        digest of the last firmware update verified by this tool.
+
+        Needs identity_cache. The device is connected, its FICR DEVICEID read
+        and its modem reset to read the root key digest. If the cache holds
+        the UUID of the chip with that DEVICEID, the identity is returned
+        without starting the IPC DFU executable, unless refresh is set.
+        Close the device when done.
+
+        :return tuple of NrfDfuErr type and identity dict:
+        """
+        return_value = self._init_connect(snr)
+        if return_value < 0:
+            return return_value, None
+
+        with self.metrics.phase("root_key_digest_wait"):
+            return_value = self.wait_for_event("boot")
+            if return_value < 0:
+                return return_value, None
+
+        digest = self._read_root_key_digest()
+        identity = self.identity_cache.get(self.snr)
+        if not refresh and identity is not None and identity["uuid"]:
+            if (not self._quiet):
+                print("Identity of %d taken from cache" % self.snr)
+            return NrfDfuErr.SUCCESS, identity
+
+        return_value = self._start_ipc_dfu(digest, ipc_path)
+        if return_value < 0:
+            return return_value, None
+        with self.metrics.phase("started_wait"):
+            return_value = self.wait_for_event("started")
+            if return_value < 0:
+                return return_value, None
+        self._init_started()
+
+        return_value, uuid = self._read_uuid()
+        if return_value < 0:
+            return return_value, None
+
+        return NrfDfuErr.SUCCESS, self.identity_cache.get(self.snr)
+
+    def _check_identity(self):
+        """
+        Reads the FICR DEVICEID of the chip. A cached identity with another
+        DEVICEID belongs to a board that was connected to the probe before,
+        and is dropped.
+        """
+        deviceid = binascii.hexlify(bytearray(self.api.read(FICR_DEVICEID, 8))).decode()
+        identity = self.identity_cache.get(self.snr)
+        if identity is not None and identity.get("deviceid") != deviceid:
+            self.identity_cache.forget(self.snr)
+        self._remember(deviceid=deviceid)
+
+    def _remember(self, **fields):
+        """
+        Updates the cached identity of the connected device, if there is a cache.
+        """
+        if self.identity_cache is not None and self.snr is not None:
+            self.identity_cache.update(self.snr, **fields)
+
     def close(self):
         """
         Closes connection to the device
@@ -0,0 +1,86 @@
+import time
+
+from nrf9160_mdm_dfu.api.nrf_dfu_API import NrfDfuErr
+
+OPERATIONS = ("uuid", "digest", "read", "update")
+
+
+class StepResult(object):
+    """
+    Outcome of one operation of a batch.
+
+    :param value: UUID or digest string for uuid and digest operations.
+    :param error: what failed, or None when the operation succeeded.
+    """
+
+    def __init__(self, op, result, value=None, duration=0.0, error=None):
+        self.op = op
+        self.result = result
+        self.value = value
+        self.duration = duration
+        self.error = error
+
+    @property
+    def success(self):
+        return self.result == NrfDfuErr.SUCCESS
+
+    def as_dict(self):
+        return {"op": self.op, "result": int(self.result), "value": self.value,
+                "duration": self.duration, "error": self.error}
+
+
+def run_operation(nrf_dfu, step):
+    """
+    Runs one operation on an initialized device.
+
+    step is a dict with "op" and its parameters:
+    {"op": "uuid"}, {"op": "digest"},
+    {"op": "read", "address": "0x...", "length": "0x...", "path": ...} and
+    {"op": "update", "fw_path": ..., "fw_digest_path": ..., "options": {...}},
+    where update also verifies the update.
+
+    :return tuple of NrfDfuErr type and the value, or what failed on error:
+    """
+    op = step.get("op")
+    if op == "uuid":
+        return_value, uuid = nrf_dfu._read_uuid()
+        return return_value, ''.join(uuid).strip("\x00")
+    elif op == "digest":
+        return nrf_dfu.read_digest()
+    elif op == "read":
+        return nrf_dfu.read(step["address"], step["length"], step["path"]), None
+    elif op == "update":
+        return_value = nrf_dfu.update_firmware(step["fw_path"], **step.get("options", {}))
+        if return_value < 0:
+            if nrf_dfu.failed_address is not None:
+                return return_value, "update, verification failed at %s" % hex(nrf_dfu.failed_address)
+            return return_value, "update"
+        return_value = nrf_dfu.verify_update(step["fw_path"], step["fw_digest_path"])
+        if return_value < 0:
+            return return_value, "verify"
+        return return_value, None
+
+    return NrfDfuErr.INVALID_PARAMETER, "unknown op %r" % op
+
+
+def run_batch(nrf_dfu, steps):
+    """
+    Runs the operations in order on an initialized device, stopping at the
+    first failure.
+
+    :return list of StepResult, one for each operation that was run:
+    """
+    results = []
+    for step in steps:
+        start = time.time()
+        try:
+            return_value, value = run_operation(nrf_dfu, step)
+        except Exception as e:
+            return_value, value = NrfDfuErr.NRFJPROG_ERRROR, str(e)
+        duration = time.time() - start
+        if return_value < 0:
+            results.append(StepResult(step.get("op"), return_value, duration=duration, error=value))
+            break
+        results.append(StepResult(step.get("op"), return_value, value, duration))
+
+    return results
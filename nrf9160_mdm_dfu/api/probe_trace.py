@@ -0,0 +1,200 @@
+import binascii
+import collections
+import json
+import time
+
+TRACE_VERSION = 1
+
+# Probe backend methods that are passed through without being traced.
+_UNTRACED = ("time", "sleep")
+
+
+class RecordingProbe(object):
+    """
+    Wraps a probe backend and records every call to a JSON lines trace.
+
+    Each line holds the method name (op), the address and size when the
+    method has them, the positional and keyword arguments of other
+    methods, the result of reads, the start time relative to the
+    first call and the duration in seconds. Written data is not recorded,
+    only its size.
+    """
+
+    def __init__(self, api=None, path="probe.trace.jsonl"):
+        if api is None:
+            from pynrfjprog import API
+            api = API.API("NRF91")
+        self._api = api
+        self._clock = getattr(api, "time", time.time)
+        self._file = open(path, "w")
+        self._file.write(json.dumps({"trace": TRACE_VERSION, "start": time.time()}) + "\n")
+        self._start = None
+
+    def __getattr__(self, name):
+        function = getattr(self._api, name)
+        # Classes, like the error type of the backend, are not calls to trace.
+        if name in _UNTRACED or not callable(function) or isinstance(function, type):
+            return function
+
+        def traced(*args, **kwargs):
+            start = self._clock()
+            if self._start is None:
+                self._start = start
+            result = function(*args, **kwargs)
+            duration = self._clock() - start
+            record = _describe(name, args, result, kwargs)
+            record["t"] = round(start - self._start, 7)
+            record["duration"] = round(duration, 7)
+            self._file.write(json.dumps(record) + "\n")
+            return result
+
+        return traced
+
+    def close(self):
+        try:
+            self.__getattr__("close")()
+        finally:
+            self._file.close()
+
+
+def _describe(name, args, result, kwargs=None):
+    record = {"op": name}
+    if name in ("write_u32", "read_u32", "write", "read"):
+        record["addr"] = args[0]
+    if name == "write_u32":
+        record["value"] = args[1]
+        record["size"] = 4
+    elif name == "read_u32":
+        record["size"] = 4
+        record["result"] = result
+    elif name == "write":
+        record["size"] = len(args[1])
+    elif name == "read":
+        record["size"] = args[1]
+        if result is not None:
+            record["result"] = binascii.hexlify(bytearray(result)).decode()
+    else:
+        if args:
+            record["args"] = [_json_value(arg) for arg in args]
+        if kwargs:
+            record["kwargs"] = {key: _json_value(value) for key, value in kwargs.items()}
+        if result is not None:
+            record["result"] = _json_value(result)
+    return record
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, (list, tuple)):
+        return [_json_value(item) for item in value]
+    return str(value)
+
+
+def read_trace(path):
+    """
+    :return list of the trace records in path:
+    """
+    records = []
+    with open(path) as f:
+        header = json.loads(f.readline())
+        if header.get("trace") != TRACE_VERSION:
+            raise ValueError("Unsupported trace file: %s" % path)
+        for line in f:
+            records.append(json.loads(line))
+    return records
+
+
+def summarize_trace(path):
+    """
+    :return dict mapping each op to its call count, bytes and total duration:
+    """
+    summary = collections.OrderedDict()
+    for record in read_trace(path):
+        op = summary.setdefault(record["op"], {"calls": 0, "bytes": 0, "duration": 0.0})
+        op["calls"] += 1
+        op["bytes"] += record.get("size", 0)
+        op["duration"] += record["duration"]
+    return summary
+
+
+class ReplayProbe(object):
+    """
+    Probe backend that answers calls from a recorded trace, without hardware.
+
+    Calls are matched to the trace in order by op, address and size, so
+    reads return what was read when the trace was recorded. Consecutive
+    identical calls, like the polls of an event register, form a run: a
+    poll returns the result recorded at the same time since the run
+    started. That way a changed poll schedule sees the modem finish at the
+    recorded time, instead of after the recorded number of polls.
+
+    Time runs on a virtual clock, advanced by the recorded durations and
+    by sleep(). time_scale is the fraction of that time also slept in
+    wall-clock time, 0 replays as fast as possible and 1 in recorded time.
+    """
+
+    def __init__(self, path, time_scale=0.0):
+        self.records = read_trace(path)
+        self.time_scale = time_scale
+        self.clock = 0.0
+        self.skipped = 0
+        self._position = 0
+        self._run = None
+
+    def time(self):
+        return self.clock
+
+    def sleep(self, seconds):
+        self._advance(seconds)
+
+    def _advance(self, seconds):
+        self.clock += seconds
+        if self.time_scale > 0 and seconds > 0:
+            time.sleep(seconds * self.time_scale)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+
+        def replayed(*args, **kwargs):
+            key = _key(_describe(name, args, None, kwargs))
+            record = self._match(key)
+            self._advance(record["duration"])
+            return self._result(record)
+
+        return replayed
+
+    def _match(self, key):
+        if self._run is not None and self._run[0] == key:
+            key, start, first, end, entered = self._run
+            # The latest recorded call of the run at the same time since the run started.
+            elapsed = self.clock - entered
+            index = first
+            while index + 1 < end and self.records[index + 1]["t"] - start <= elapsed:
+                index += 1
+            return self.records[index]
+
+        position = self._position
+        while position < len(self.records) and _key(self.records[position]) != key:
+            position += 1
+        if position == len(self.records):
+            raise ValueError("Call not found in trace: %s" % (key,))
+        self.skipped += position - self._position
+
+        end = position + 1
+        while end < len(self.records) and _key(self.records[end]) == key:
+            end += 1
+        self._position = end
+        self._run = (key, self.records[position]["t"], position, end, self.clock)
+        return self.records[position]
+
+    def _result(self, record):
+        op = record["op"]
+        if op == "read":
+            return list(bytearray(binascii.unhexlify(record["result"])))
+        return record.get("result")
+
+
+def _key(record):
+    return (record["op"], record.get("addr"), record.get("size"))
@@ -0,0 +1,94 @@
+import collections
+import struct
+
+
+class RegisterWrite(collections.namedtuple("RegisterWrite", ["address", "value"])):
+    """
+    One 32 bit register or memory word write.
+    """
+    __slots__ = ()
+
+
+# Ordering point: writes before it are never merged with writes after it.
+BARRIER = "barrier"
+
+IPC_SETUP = (
+    # APP IPC as non-secure.
+    RegisterWrite(0x500038A8, 0x00000002),
+    # IPC send and receive channels and GPMEM for DFU.
+    RegisterWrite(0x4002A514, 0x00000002),
+    RegisterWrite(0x4002A51C, 0x00000008),
+    RegisterWrite(0x4002A610, 0x21000000),
+    RegisterWrite(0x4002A614, 0x00000000),
+    RegisterWrite(0x4002A590, 0x00000001),
+    RegisterWrite(0x4002A598, 0x00000004),
+    RegisterWrite(0x4002A5A0, 0x00000010),
+)
+
+# All 32 APP RAM regions as non-secure.
+RAM_PERMISSIONS = tuple(RegisterWrite(0x50003700 + region * 4, 0x00000007) for region in range(32))
+
+DFU_INDICATION = (
+    RegisterWrite(0x20000000, 0x80010000),
+    RegisterWrite(0x20000004, 0x2100000C),
+    RegisterWrite(0x20000008, 0x0003FC00),
+)
+
+# Every toggle of the modem reset is its own write, in this order.
+MODEM_RESET = (
+    RegisterWrite(0x50005610, 0x00000000),
+    BARRIER,
+    RegisterWrite(0x50005614, 0x00000001),
+    BARRIER,
+    RegisterWrite(0x50005610, 0x00000001),
+    BARRIER,
+    RegisterWrite(0x50005614, 0x00000000),
+    BARRIER,
+    RegisterWrite(0x50005610, 0x00000000),
+)
+
+
+def coalesce(script):
+    """
+    Merges runs of writes to consecutive words into blocks.
+
+    Writes keep their order, a run is only extended by a write to the word
+    following it, and BARRIER always ends a run.
+
+    :param script: sequence of RegisterWrite and BARRIER.
+    :return list of (address, bytes) tuples, one per probe write:
+    """
+    blocks = []
+    address = None
+    data = bytearray()
+    for step in script:
+        if step == BARRIER or address is None or step.address != address + len(data):
+            if address is not None:
+                blocks.append((address, bytes(data)))
+            address = None
+            data = bytearray()
+            if step == BARRIER:
+                continue
+            address = step.address
+        data += struct.pack("<I", step.value)
+
+    if address is not None:
+        blocks.append((address, bytes(data)))
+
+    return blocks
+
+
+def run_script(api, script, control=True):
+    """
+    Performs a register script with as few probe writes as possible.
+
+    :return number of probe writes:
+    """
+    blocks = coalesce(script)
+    for address, data in blocks:
+        if len(data) == 4:
+            api.write_u32(address, struct.unpack("<I", data)[0], control)
+        else:
+            api.write(address, data, control)
+
+    return len(blocks)
@@ -0,0 +1,204 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+
+from nrf9160_mdm_dfu.api import identity_cache
+from nrf9160_mdm_dfu.api import ipc_catalog
+from nrf9160_mdm_dfu.api import nrf_dfu_API
+from nrf9160_mdm_dfu.api import operations
+from nrf9160_mdm_dfu.api.nrf_dfu_API import NrfDfuErr
+
+DEFAULT_SOCKET_PATH = os.path.join(os.path.expanduser("~"), ".nrf9160_mdm_dfu", "session.sock")
+
+
+class DfuSession(object):
+    """
+    One device with the IPC DFU executable running, kept open between requests.
+    """
+
+    def __init__(self, snr, ipc_path=None, simulate=False, catalog=None):
+        probe = None
+        if simulate:
+            from nrf9160_mdm_dfu.api import sim_probe
+            probe = sim_probe.SimulatedProbe(snr=snr)
+        self.snr = snr
+        self.lock = threading.Lock()
+        self.dfu = nrf_dfu_API.nrf_dfu_API(quiet=True, api=probe, ipc_catalog=catalog,
+                                           identity_cache=identity_cache.IdentityCache())
+        self.result = self.dfu.init(snr, ipc_path)
+
+    def run(self, message):
+        """
+        Runs one operation on the device, see operations.run_operation.
+
+        :return tuple of NrfDfuErr type and the value returned to the client:
+        """
+        return operations.run_operation(self.dfu, message)
+
+    def close(self):
+        self.dfu.close()
+
+
+class SessionServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """
+    Local server that keeps one DfuSession per serial number.
+
+    Clients send one JSON object per line, e.g. {"op": "uuid", "snr": 683012345},
+    and get one JSON object per line back, {"result": 0, "value": ...}.
+    A session is opened by the first request for its serial number and stays
+    open until a "close" request for it, or a "shutdown" request.
+    """
+    daemon_threads = True
+
+    def __init__(self, socket_path=None, ipc_path=None, simulate=False, ipc_dir=None):
+        if socket_path is None:
+            socket_path = DEFAULT_SOCKET_PATH
+        directory = os.path.dirname(os.path.abspath(socket_path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        self.socket_path = socket_path
+        self.ipc_path = ipc_path
+        self.simulate = simulate
+        self.catalog = None
+        if ipc_dir is not None:
+            self.catalog = ipc_catalog.IpcCatalog(ipc_dir)
+        self.sessions = {}
+        self._sessions_lock = threading.Lock()
+        # One lock per serial number, held while its session is opened.
+        self._opening = {}
+        socketserver.UnixStreamServer.__init__(self, socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def session(self, snr, ipc_path=None):
+        """
+        Returns the open session of snr, opening it if needed.
+
+        Opening a session initializes the device, which takes seconds. Only
+        other requests for the same serial number wait for it.
+
+        :return tuple of NrfDfuErr type and DfuSession:
+        """
+        with self._sessions_lock:
+            session = self.sessions.get(snr)
+            if session is not None:
+                return NrfDfuErr.SUCCESS, session
+            opening = self._opening.setdefault(snr, threading.Lock())
+
+        with opening:
+            with self._sessions_lock:
+                # Opened by another request while this one waited.
+                session = self.sessions.get(snr)
+            if session is None:
+                session = DfuSession(snr, ipc_path or self.ipc_path, self.simulate, self.catalog)
+                if session.result < 0:
+                    session.close()
+                    return session.result, None
+                with self._sessions_lock:
+                    self.sessions[snr] = session
+        return NrfDfuErr.SUCCESS, session
+
+    def dispatch(self, message):
+        """
+        :return dict with the response to one request:
+        """
+        op = message.get("op")
+        snr = message.get("snr")
+        try:
+            if op == "shutdown":
+                # The request handler stops the server once the response is sent.
+                return {"result": int(NrfDfuErr.SUCCESS)}
+            if op == "close":
+                with self._sessions_lock:
+                    session = self.sessions.pop(snr, None)
+                if session is not None:
+                    with session.lock:
+                        session.close()
+                return {"result": int(NrfDfuErr.SUCCESS)}
+
+            return_value, session = self.session(snr, message.get("ipc_path"))
+            if return_value < 0:
+                return {"result": int(return_value), "error": "init failed"}
+            with session.lock:
+                return_value, value = session.run(message)
+            if return_value < 0:
+                return {"result": int(return_value), "error": value}
+            return {"result": int(return_value), "value": value}
+        except Exception as e:
+            return {"result": int(NrfDfuErr.NRFJPROG_ERRROR), "error": str(e)}
+
+    def close_sessions(self):
+        with self._sessions_lock:
+            sessions = list(self.sessions.values())
+            self.sessions = {}
+        for session in sessions:
+            with session.lock:
+                session.close()
+
+    def serve(self):
+        """
+        Serves requests until a shutdown request or KeyboardInterrupt, then
+        closes all sessions and removes the socket.
+        """
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.server_close()
+            self.close_sessions()
+            if os.path.exists(self.socket_path):
+                os.remove(self.socket_path)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                message = json.loads(line.decode())
+            except ValueError:
+                message = None
+            if isinstance(message, dict):
+                response = self.server.dispatch(message)
+            else:
+                response = {"result": int(NrfDfuErr.INVALID_PARAMETER), "error": "invalid request"}
+            self.wfile.write((json.dumps(response) + "\n").encode())
+            self.wfile.flush()
+            if response["result"] == NrfDfuErr.SUCCESS and message.get("op") == "shutdown":
+                threading.Thread(target=self.server.shutdown).start()
+                return
+
+
+class SessionClient(object):
+    """
+    Client of a SessionServer.
+    """
+
+    def __init__(self, socket_path=None):
+        if socket_path is None:
+            socket_path = DEFAULT_SOCKET_PATH
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.connect(socket_path)
+        self._file = self._socket.makefile("rwb")
+
+    def request(self, op, **fields):
+        """
+        Sends one request and waits for its response.
+
+        :return dict with "result" and either "value" or "error":
+        """
+        fields["op"] = op
+        self._file.write((json.dumps(fields) + "\n").encode())
+        self._file.flush()
+        line = self._file.readline()
+        if not line:
+            return {"result": int(NrfDfuErr.NRFJPROG_ERRROR), "error": "connection closed"}
+        return json.loads(line.decode())
+
+    def close(self):
+        self._file.close()
+        self._socket.close()
@@ -0,0 +1,384 @@
+import hashlib
+import time
+
+# Default response words written by the modem into the command mailbox.
+RESPONSE_OK = 0xA5000001
+RESPONSE_UNKNOWN_COMMAND = 0x5A000001
+RESPONSE_COMMAND_ERROR = 0x5A000002
+
+PAGE_SIZE = 8192
+
+# Digests are only calculated of memory below this address.
+DIGEST_LIMIT = 0x1000000
+
+# J-Link speed used when connecting without an explicit speed.
+DEFAULT_SPEED_KHZ = 2000
+
+RAM_BASE = 0x20000000
+RAM_SIZE = 0x40000
+
+DFU_MAGIC = 0x80010000
+
+EVENT_FAULT = 0x4002A100
+EVENT_COMMAND = 0x4002A108
+EVENT_DATA = 0x4002A110
+TASK_APP_CTRL = 0x4002A004
+MODEM_RESET = 0x50005610
+FICR_DEVICEID = 0x00FF0204
+
+COMMAND_ERASE = 2
+COMMAND_WRITE = 3
+COMMAND_READ = 4
+COMMAND_DIGEST = 7
+COMMAND_UUID = 8
+
+_STATE_OFF = 0
+_STATE_BOOTLOADER = 1
+_STATE_DFU = 2
+
+
+class ProbeError(Exception):
+    """
+    Failure of a probe call, raised by simulated probes in place of
+    pynrfjprog's APIError, e.g. to inject faults.
+    """
+
+
+class SimulatedProbe(object):
+    """
+    In-process stand-in for pynrfjprog's API object connected to an nRF9160.
+
+    Implements the subset of the API used by nrf_dfu_API and a model of the
+    modem side of the IPC DFU protocol: the event registers, the command
+    mailbox at 0x2000000C and the erase, write, read, digest and UUID commands.
+
+    Time is tracked on a virtual clock (``clock``). Every probe transaction
+    advances it by ``transaction_latency`` plus the payload size divided by
+    the SWD bandwidth; modem commands complete ``flash`` time later.
+    ``swd_bandwidth`` is the bandwidth at the default J-Link speed, it scales
+    with the speed given on connect. Above ``max_swd_khz``, as on a long
+    cable, reads return corrupted data. The
+    virtual time is also slept in wall-clock time scaled by ``time_scale``,
+    so timeouts in the host code behave as they would on hardware. Use
+    ``time_scale=0`` for fast, deterministic runs.
+    """
+
+    # The exception type of failed probe calls, see nrf_dfu_API.
+    error_type = ProbeError
+
+    def __init__(self, root_key_digest=None, uuid="50503041-3633-4261-803d-1e2b8f70111a",
+                 swd_bandwidth=250000, transaction_latency=0.0005,
+                 page_erase_time=0.05, flash_write_rate=500000, flash_read_rate=4000000,
+                 hash_rate=8000000, boot_time=0.2, time_scale=0.0, snr=None, max_swd_khz=None,
+                 device_id=None):
+        if root_key_digest is None:
+            root_key_digest = bytes(range(32))
+        if device_id is None:
+            # Boards with another UUID are other chips, with another FICR DEVICEID.
+            device_id = hashlib.sha256(uuid.encode("ascii")).digest()[:8]
+        self.device_id = bytes(device_id)
+        self.root_key_digest = bytes(root_key_digest)
+        self.uuid = uuid
+        self.swd_bandwidth = swd_bandwidth
+        self.transaction_latency = transaction_latency
+        self.page_erase_time = page_erase_time
+        self.flash_write_rate = flash_write_rate
+        self.flash_read_rate = flash_read_rate
+        self.hash_rate = hash_rate
+        self.boot_time = boot_time
+        self.time_scale = time_scale
+        self.snr = snr
+        self.max_swd_khz = max_swd_khz
+        self.speed_khz = DEFAULT_SPEED_KHZ
+
+        self.clock = 0.0
+        self.transactions = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        self.modem_busy_time = 0.0
+
+        self.ram = bytearray(RAM_SIZE)
+        self.flash = {}
+        self.registers = {FICR_DEVICEID: int.from_bytes(self.device_id[0:4], "little"),
+                          FICR_DEVICEID + 4: int.from_bytes(self.device_id[4:8], "little")}
+        self._events = {EVENT_FAULT: 0, EVENT_COMMAND: 0, EVENT_DATA: 0}
+        self._state = _STATE_OFF
+        self._reset_asserted = False
+        self._pending = None
+        self._is_open = False
+
+    # pynrfjprog API subset
+
+    def open(self):
+        self._is_open = True
+
+    def close(self):
+        self._is_open = False
+
+    def enum_emu_snr(self):
+        if self.snr is None:
+            return None
+        return [self.snr]
+
+    def read_connected_emu_snr(self):
+        if self.snr is None:
+            return 0
+        return self.snr
+
+    def connect_to_emu_with_snr(self, serial_number, jlink_speed_khz=DEFAULT_SPEED_KHZ):
+        self.speed_khz = jlink_speed_khz
+        self._transaction(0)
+
+    def connect_to_emu_without_snr(self, jlink_speed_khz=DEFAULT_SPEED_KHZ):
+        self.speed_khz = jlink_speed_khz
+        self._transaction(0)
+
+    def disconnect_from_emu(self):
+        self._transaction(0)
+
+    def read_device_family(self):
+        return "NRF91"
+
+    def sys_reset(self):
+        self._transaction(0)
+        self._state = _STATE_OFF
+        self._pending = None
+
+    def go(self):
+        self._transaction(0)
+
+    def power_ram_all(self):
+        self._transaction(0)
+
+    def write_u32(self, addr, data, control):
+        self._transaction(4)
+        self._write_word(addr, data)
+
+    def read_u32(self, addr):
+        self._transaction(4)
+        return self._read_word(addr)
+
+    def write(self, addr, data, control):
+        self._transaction(len(data))
+        if self._in_ram(addr, len(data)):
+            offset = addr - RAM_BASE
+            self.ram[offset:offset + len(data)] = bytes(data)
+        else:
+            for i in range(0, len(data) - len(data) % 4, 4):
+                self._write_word(addr + i, int.from_bytes(bytes(data[i:i + 4]), "little"))
+
+    def read(self, addr, data_len):
+        self._transaction(data_len)
+        if self._in_ram(addr, data_len):
+            offset = addr - RAM_BASE
+            data = list(self.ram[offset:offset + data_len])
+        else:
+            data = []
+            for i in range(0, data_len, 4):
+                data += list(self._read_word(addr + i).to_bytes(4, "little"))
+            data = data[:data_len]
+        if self.max_swd_khz is not None and self.speed_khz > self.max_swd_khz and data:
+            data[-1] ^= 0x01
+        return data
+
+    # Simulation helpers
+
+    def time(self):
+        """
+        Returns the virtual clock, used by nrf_dfu_API for event waits.
+        """
+        return self.clock
+
+    def sleep(self, seconds):
+        """
+        Lets virtual time pass without a probe transaction.
+        """
+        self._advance(seconds)
+
+    def flash_contents(self, address, length):
+        """
+        Returns the simulated modem flash contents as bytes.
+        """
+        data = bytearray()
+        end = address + length
+        while address < end:
+            page = address - address % PAGE_SIZE
+            offset = address - page
+            count = min(PAGE_SIZE - offset, end - address)
+            data += self.flash.get(page, b"\xff" * PAGE_SIZE)[offset:offset + count]
+            address += count
+        return bytes(data)
+
+    def _in_ram(self, addr, length):
+        return RAM_BASE <= addr and addr + length <= RAM_BASE + RAM_SIZE
+
+    def _advance(self, seconds):
+        self.clock += seconds
+        if self.time_scale:
+            time.sleep(seconds * self.time_scale)
+        self._service_modem()
+
+    def _transaction(self, nbytes):
+        self.transactions += 1
+        bandwidth = self.swd_bandwidth * float(self.speed_khz) / DEFAULT_SPEED_KHZ
+        self._advance(self.transaction_latency + float(nbytes) / bandwidth)
+
+    def _ram_u32(self, addr):
+        offset = addr - RAM_BASE
+        return int.from_bytes(self.ram[offset:offset + 4], "little")
+
+    def _set_ram_u32(self, addr, value):
+        offset = addr - RAM_BASE
+        self.ram[offset:offset + 4] = (value & 0xFFFFFFFF).to_bytes(4, "little")
+
+    def _read_word(self, addr):
+        self.bytes_read += 4
+        if addr in self._events:
+            return self._events[addr]
+        if self._in_ram(addr, 4):
+            return self._ram_u32(addr)
+        return self.registers.get(addr, 0)
+
+    def _write_word(self, addr, value):
+        self.bytes_written += 4
+        if addr in self._events:
+            # The host can only clear events, setting them is up to the modem.
+            if value == 0:
+                self._events[addr] = 0
+        elif self._in_ram(addr, 4):
+            self._set_ram_u32(addr, value)
+        else:
+            self.registers[addr] = value
+            if addr == MODEM_RESET:
+                self._modem_reset(value)
+            elif addr == TASK_APP_CTRL and value == 1:
+                self._app_ctrl_task()
+
+    def _modem_reset(self, value):
+        if value == 1:
+            self._reset_asserted = True
+            self._state = _STATE_OFF
+            self._pending = None
+        elif self._reset_asserted:
+            self._reset_asserted = False
+            if self._ram_u32(RAM_BASE) == DFU_MAGIC:
+                self._schedule(self.boot_time, self._boot)
+
+    def _schedule(self, duration, action):
+        self.modem_busy_time += duration
+        self._pending = (self.clock + duration, action)
+
+    def _service_modem(self):
+        if self._pending is not None and self.clock >= self._pending[0]:
+            action = self._pending[1]
+            self._pending = None
+            action()
+            self._events[EVENT_COMMAND] = 1
+
+    def _boot(self):
+        self._state = _STATE_BOOTLOADER
+        self._set_ram_u32(RAM_BASE + 0x0C, RESPONSE_OK)
+        offset = 0x10
+        self.ram[offset:offset + 32] = self.root_key_digest
+
+    def _app_ctrl_task(self):
+        if self._pending is not None:
+            return
+        if self._state == _STATE_BOOTLOADER:
+            self._schedule(self.boot_time, self._started)
+        elif self._state == _STATE_DFU:
+            self._command()
+
+    def _started(self):
+        self._state = _STATE_DFU
+        self._set_ram_u32(RAM_BASE + 0x0C, RESPONSE_OK)
+
+    def _command(self):
+        command = self._ram_u32(RAM_BASE + 0x0C)
+        address = self._ram_u32(RAM_BASE + 0x10)
+        length = self._ram_u32(RAM_BASE + 0x14)
+
+        if command == COMMAND_ERASE:
+            if address % PAGE_SIZE or length % PAGE_SIZE or length == 0:
+                self._schedule(0, lambda: self._command_error(address))
+            else:
+                self._schedule(length // PAGE_SIZE * self.page_erase_time,
+                               lambda: self._erase(address, length))
+        elif command == COMMAND_WRITE:
+            if address % PAGE_SIZE or length > RAM_SIZE - 0x18:
+                self._schedule(0, lambda: self._command_error(address))
+            else:
+                pages = (length + PAGE_SIZE - 1) // PAGE_SIZE
+                duration = pages * self.page_erase_time + float(length) / self.flash_write_rate
+                self._schedule(duration, lambda: self._write_flash(address, length))
+        elif command == COMMAND_READ:
+            if length > RAM_SIZE - 0x10:
+                self._schedule(0, lambda: self._command_error(address))
+            else:
+                self._schedule(float(length) / self.flash_read_rate,
+                               lambda: self._read_flash(address, length))
+        elif command == COMMAND_DIGEST:
+            ranges = []
+            for n in range(0, address):
+                ranges.append((self._ram_u32(RAM_BASE + 0x14 + n * 8),
+                               self._ram_u32(RAM_BASE + 0x18 + n * 8)))
+            total = sum(r[1] for r in ranges)
+            outside = [r[0] for r in ranges if r[0] + r[1] > DIGEST_LIMIT]
+            if outside:
+                self._schedule(0, lambda: self._command_error(outside[0]))
+            else:
+                self._schedule(float(total) / self.hash_rate, lambda: self._digest(ranges))
+        elif command == COMMAND_UUID:
+            self._schedule(0, self._read_uuid)
+        else:
+            self._schedule(0, self._unknown_command)
+
+    def _respond(self, value):
+        self._set_ram_u32(RAM_BASE + 0x0C, value)
+
+    def _unknown_command(self):
+        self._respond(RESPONSE_UNKNOWN_COMMAND)
+
+    def _command_error(self, address):
+        self._respond(RESPONSE_COMMAND_ERROR)
+        self._set_ram_u32(RAM_BASE + 0x10, address)
+
+    def _erase(self, address, length):
+        for page in range(address, address + length, PAGE_SIZE):
+            self.flash.pop(page, None)
+        self._respond(RESPONSE_OK)
+
+    def _write_flash(self, address, length):
+        data = self.ram[0x18:0x18 + length]
+        end = address + length
+        while address < end:
+            page = address - address % PAGE_SIZE
+            offset = address - page
+            count = min(PAGE_SIZE - offset, end - address)
+            if offset == 0 and count == PAGE_SIZE:
+                contents = bytearray(data[:count])
+            else:
+                contents = bytearray(self.flash.get(page, b"\xff" * PAGE_SIZE))
+                contents[offset:offset + count] = data[:count]
+            self.flash[page] = contents
+            data = data[count:]
+            address += count
+        self._respond(RESPONSE_OK)
+
+    def _read_flash(self, address, length):
+        self.ram[0x10:0x10 + length] = self.flash_contents(address, length)
+        self._respond(RESPONSE_OK)
+
+    def _digest(self, ranges):
+        sha = hashlib.sha256()
+        for address, length in ranges:
+            sha.update(self.flash_contents(address, length))
+        digest = sha.digest()
+        # The host reads the digest word by word as big endian values.
+        for i in range(0, 32, 4):
+            self.ram[0x10 + i:0x14 + i] = digest[i:i + 4][::-1]
+        self._respond(RESPONSE_OK)
+
+    def _read_uuid(self):
+        self.ram[0x10:0x10 + 36] = self.uuid.encode("ascii")[:36].ljust(36, b"\x00")
+        self._respond(RESPONSE_OK)
@@ -0,0 +1,123 @@
+import concurrent.futures
+import json
+import signal
+import time
+
+from nrf9160_mdm_dfu.api import multi_dfu
+from nrf9160_mdm_dfu.api.nrf_dfu_API import NrfDfuErr
+
+
+def _ignore_interrupt():
+    # Ctrl+C stops the station, boards already being updated are finished.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class Station(object):
+    """
+    Updates every board as soon as its probe is connected.
+
+    The connected probes are enumerated every poll_interval seconds and each
+    new serial number is queued for init, update_firmware and verify_update
+    in a worker process, as in multi_dfu. A board that was updated is not
+    updated again in the same session. A board that failed is retried once
+    it has been unplugged and connected again.
+    """
+
+    def __init__(self, job_factory, max_workers=4, max_queue=None, poll_interval=1.0,
+                 log_path=None, enumerate_probes=None, quiet=False, on_result=None):
+        """
+        :param job_factory: function returning the multi_dfu.DeviceJob for a serial number.
+        :param max_queue: max number of boards queued or being updated, defaults to twice max_workers.
+        :param log_path: file to append one JSON line per board result to.
+        :param enumerate_probes: function returning the connected serial numbers,
+            defaults to multi_dfu.enumerate_probes.
+        :param on_result: function called with every multi_dfu.DeviceResult as it finishes.
+        """
+        if max_queue is None:
+            max_queue = 2 * max_workers
+        if enumerate_probes is None:
+            enumerate_probes = multi_dfu.enumerate_probes
+        self._job_factory = job_factory
+        self._max_workers = max_workers
+        self._max_queue = max(max_queue, max_workers)
+        self._poll_interval = poll_interval
+        self._log_path = log_path
+        self._enumerate_probes = enumerate_probes
+        self._quiet = quiet
+        self._on_result = on_result
+        self.updated = set()
+        self.failed = set()
+        self.results = []
+
+    def run(self, until=None):
+        """
+        Runs until KeyboardInterrupt, or until the function until returns True.
+        Boards being updated are finished before returning.
+
+        :return list of multi_dfu.DeviceResult in the order they finished:
+        """
+        active = {}
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self._max_workers,
+                                                    initializer=_ignore_interrupt) as executor:
+            try:
+                while until is None or not until():
+                    connected = self._connected()
+                    if connected is not None:
+                        # A failed board is retried after it has been reconnected.
+                        self.failed &= connected
+                        busy = set(active.values())
+                        for snr in sorted(connected - self.updated - self.failed - busy):
+                            if len(active) >= self._max_queue:
+                                break
+                            if (not self._quiet):
+                                print("Board %s connected, starting update" % snr)
+                            active[executor.submit(multi_dfu.update_device, self._job_factory(snr))] = snr
+
+                    if not active:
+                        time.sleep(self._poll_interval)
+                        continue
+                    done, _ = concurrent.futures.wait(active, timeout=self._poll_interval)
+                    for future in done:
+                        self._finished(active.pop(future), future)
+            except KeyboardInterrupt:
+                if (not self._quiet):
+                    print("Stopping, waiting for %d boards" % len(active))
+
+            for future in concurrent.futures.as_completed(active):
+                self._finished(active.pop(future), future)
+
+        return self.results
+
+    def _connected(self):
+        """
+        :return set of the connected serial numbers, or None if enumerating failed:
+        """
+        try:
+            return set(self._enumerate_probes())
+        except Exception as e:
+            # A USB hub or probe hiccup should not stop the station, try again at the next poll.
+            print("ERROR: Enumerating the probes failed: %s" % e)
+            return None
+
+    def _finished(self, snr, future):
+        try:
+            result = future.result()
+        except Exception as e:
+            result = multi_dfu.DeviceResult(snr, NrfDfuErr.NRFJPROG_ERRROR, error=str(e))
+
+        if result.success:
+            self.updated.add(snr)
+        else:
+            self.failed.add(snr)
+        self.results.append(result)
+
+        if (not self._quiet):
+            print("Board %s: %s%s in %.1f s" % (snr, result.result.name,
+                                                 " at " + result.step if result.step else "", result.duration))
+        if self._log_path is not None:
+            with open(self._log_path, "a") as f:
+                f.write(json.dumps({"snr": snr, "result": result.result.name, "step": result.step,
+                                    "duration": result.duration, "error": result.error, "retries": result.retries,
+                                    "timestamp": time.time()}) + "\n")
+        if self._on_result is not None:
+            self._on_result(result)
@@ -0,0 +1,101 @@
+import json
+import os
+import random
+import tempfile
+import time
+
+DEFAULT_PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".nrf9160_mdm_dfu", "profiles")
+
+DEFAULT_SPEEDS_KHZ = (1000, 2000, 4000, 8000, 12000)
+
+# Page multiples up to the largest chunk that fits the shared DFU buffer.
+DEFAULT_CHUNK_SIZES = (0x8000, 0x10000, 0x20000, 0x3E000)
+
+# Calibration data is written to the shared DFU buffer.
+_TEST_ADDRESS = 0x20000018
+
+
+def profile_path(snr, profile_dir=None):
+    if profile_dir is None:
+        profile_dir = DEFAULT_PROFILE_DIR
+    return os.path.join(profile_dir, "%d.json" % snr)
+
+
+def load_profile(snr, profile_dir=None):
+    """
+    :return the tuning profile of the probe with serial number snr, or None:
+    """
+    try:
+        with open(profile_path(snr, profile_dir)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_profile(profile, profile_dir=None):
+    path = profile_path(profile["snr"], profile_dir)
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, temp_path = tempfile.mkstemp(dir=directory)
+    with os.fdopen(fd, "w") as f:
+        json.dump(profile, f, indent=1, sort_keys=True)
+    os.replace(temp_path, path)
+
+
+def calibrate(api, snr, speeds=DEFAULT_SPEEDS_KHZ, chunk_sizes=DEFAULT_CHUNK_SIZES, repeats=3, quiet=False):
+    """
+    Measures block transfer throughput and errors at several J-Link speeds
+    and chunk sizes.
+
+    Every measurement writes random data to the shared DFU buffer and reads
+    it back; a transfer that fails or reads back other data is an error.
+    The best setting is the one with the highest throughput at a speed that
+    had no errors with any chunk size. The device is reset when done.
+
+    :param api: opened probe backend.
+    :return profile dict with "snr", "jlink_speed_khz", "chunk_size" and
+        "measurements", or None if no setting worked without errors:
+    """
+    clock = getattr(api, "time", time.time)
+    generator = random.Random(snr)
+    measurements = []
+    connected = False
+    for speed in speeds:
+        if connected:
+            api.disconnect_from_emu()
+        api.connect_to_emu_with_snr(snr, jlink_speed_khz=speed)
+        connected = True
+        api.power_ram_all()
+
+        for chunk_size in chunk_sizes:
+            errors = 0
+            elapsed = 0.0
+            for n in range(repeats):
+                data = bytes(bytearray(generator.getrandbits(8) for i in range(chunk_size)))
+                start = clock()
+                try:
+                    api.write(_TEST_ADDRESS, data, False)
+                    read_back = bytes(bytearray(api.read(_TEST_ADDRESS, chunk_size)))
+                except Exception:
+                    read_back = None
+                elapsed += clock() - start
+                if read_back != data:
+                    errors += 1
+
+            throughput = 2 * chunk_size * repeats / elapsed if elapsed > 0 else 0.0
+            measurements.append({"jlink_speed_khz": speed, "chunk_size": chunk_size,
+                                 "throughput": throughput, "errors": errors})
+            if (not quiet):
+                print("%6d kHz  chunk %7d  %10.0f B/s  %d errors" % (speed, chunk_size, throughput, errors))
+
+    api.sys_reset()
+    api.go()
+
+    failing_speeds = set(measurement["jlink_speed_khz"] for measurement in measurements if measurement["errors"])
+    good = [measurement for measurement in measurements if measurement["jlink_speed_khz"] not in failing_speeds]
+    if not good:
+        return None
+    best = max(good, key=lambda measurement: (measurement["throughput"], measurement["chunk_size"]))
+    return {"snr": snr, "jlink_speed_khz": best["jlink_speed_khz"], "chunk_size": best["chunk_size"],
+            "timestamp": time.time(), "measurements": measurements}
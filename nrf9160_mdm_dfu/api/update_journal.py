@@ -0,0 +1,51 @@
+import json
+import os
+import re
+
+DEFAULT_JOURNAL_DIR = os.path.join(os.path.expanduser("~"), ".nrf9160_mdm_dfu", "journal")
+
+
+class UpdateJournal(object):
+    """
+    On-disk record of the chunks a device has confirmed during an update.
+
+    One journal file exists per device and firmware image. Each confirmed
+    chunk is appended as one JSON line and flushed to disk, so the journal
+    survives the process being killed in the middle of an update.
+    """
+
+    def __init__(self, device_id, image_sha256, journal_dir=None):
+        if journal_dir is None:
+            journal_dir = DEFAULT_JOURNAL_DIR
+        name = "%s_%s.jsonl" % (re.sub(r"[^0-9A-Za-z-]", "_", str(device_id)), image_sha256[:16])
+        self.path = os.path.join(journal_dir, name)
+
+    def confirmed(self):
+        """
+        :return list of (address, length) tuples confirmed by the modem, in order:
+        """
+        chunks = []
+        if not os.path.isfile(self.path):
+            return chunks
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash, nothing after it was confirmed.
+                    break
+                chunks.append((entry["address"], entry["length"]))
+        return chunks
+
+    def record(self, address, length):
+        directory = os.path.dirname(self.path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(self.path, "a") as f:
+            f.write(json.dumps({"address": address, "length": length}) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self):
+        if os.path.isfile(self.path):
+            os.remove(self.path)
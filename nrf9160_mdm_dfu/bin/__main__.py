@@ -1,3 +1,4 @@
 from nrf9160_mdm_dfu.bin.nrf9160_mdm_dfu import main
 
-main()
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,17 @@
+from nrf9160_mdm_dfu.api import identity_cache
+from nrf9160_mdm_dfu.api import ipc_catalog
+from nrf9160_mdm_dfu.api import metrics
 from nrf9160_mdm_dfu.api import nrf_dfu_API
+from nrf9160_mdm_dfu.api import sim_probe
+from nrf9160_mdm_dfu.api import multi_dfu
+from nrf9160_mdm_dfu.api import operations
+from nrf9160_mdm_dfu.api import probe_trace
+from nrf9160_mdm_dfu.api import session_server
+from nrf9160_mdm_dfu.api import station
+from nrf9160_mdm_dfu.api import tuning
 import os
+import sys
+import json
 import time
 import argparse
 
@@ -11,82 +23,534 @@ def main():
     parser = argparse.ArgumentParser(description='Update the firmware of nrf9160 devices.')
     group =  parser.add_mutually_exclusive_group(required = True)
     group.add_argument('--update', help='update firmware', action='store_true')
-    group.add_argument('--read', dest='read', type=str, nargs=3, metavar=('Addr', 'Len', 'file'), help='Reading from the modem, Addr and Len must be hex values, file is a file path')
+    group.add_argument('--read', dest='read', type=str, nargs=3, metavar=('Addr', 'Len', 'file'), help='Reading from the modem, Addr and Len must be hex values, file is a file path. Files ending in .bin are written as raw binary, other files as Intel HEX.')
     group.add_argument('--UUID', help='read UUID', dest='UUID', action='store_true')
     group.add_argument('--digest', help='read digest from modem', dest='digest', action='store_true')
-    parser.add_argument('-s', '--snr', dest='snr', type=int, help='Serialnumber for the nrf9160 device.')
+    group.add_argument('--identity', help='Print the UUID, root key digest and last verified firmware digest of the devices, from the identity cache when the modem has not changed.', dest='identity', action='store_true')
+    group.add_argument('--ops', dest='ops', type=str, nargs='+', metavar='OP', help='Run several operations in one session, in order. OP is uuid, digest, update or read:Addr:Len:file.')
+    group.add_argument('--job', dest='job', type=str, metavar='path', help='Run the operations listed in a JSON job file in one session.')
+    group.add_argument('--calibrate', help='Measure the best J-Link speed and chunk size for the probe and save them as its tuning profile.', dest='calibrate', action='store_true')
+    group.add_argument('--station', help='Update every board as soon as its probe is connected, until stopped with Ctrl+C.', dest='station', action='store_true')
+    group.add_argument('--serve', help='Run a session server that keeps devices initialized between operations.', dest='serve', action='store_true')
+    parser.add_argument('-s', '--snr', dest='snr', type=int, nargs='+', help='Serialnumber for the nrf9160 device. Several serial numbers update the devices in parallel.')
+    parser.add_argument('--all', dest='all', help='Update all connected nrf9160 devices in parallel.', action='store_true')
+    parser.add_argument('--jobs', dest='jobs', type=int, metavar='N', help='Max number of devices updated at the same time.')
+    parser.add_argument('--max-per-controller', dest='max_per_controller', type=positive_int, metavar='N', help='Max number of devices updated at the same time on one USB controller.')
+    parser.add_argument('--queue', dest='queue', type=int, metavar='N', help='Max number of boards queued or being updated in --station mode.')
+    parser.add_argument('--poll-interval', dest='poll_interval', type=float, metavar='S', default=1.0, help='Seconds between probe enumerations in --station mode.')
+    parser.add_argument('--station-log', dest='station_log', type=str, metavar='path', default='nrf9160_station.jsonl', help='File the --station mode appends one JSON line per board result to.')
+    parser.add_argument('--controllers', dest='controllers', type=str, metavar='path', help='JSON file mapping serial numbers to USB controller names.')
+    parser.add_argument('--refresh', dest='refresh', help='Read the --identity from the devices, also when it is cached.', action='store_true')
+    parser.add_argument('--progress', dest='progress', help='Show the progress as a single line with throughput and time left, instead of the step by step output.', action='store_true')
     parser.add_argument('-q', '--quiet', dest='quiet', help='Enables quiet mode.', action='store_true')
     parser.add_argument('--fwpath', dest='fwpath', help='firmware update image path', type=str, nargs=1, metavar='path', default=["firmware.update.image.hex"])
     parser.add_argument('--ipcpath', dest='ipcpath', help='IPC hex file path', type=str, nargs=1, metavar='path')
+    parser.add_argument('--ipcdir', dest='ipcdir', type=str, metavar='path', help='Directory tree to find the IPC DFU executable matching the modem in.')
     parser.add_argument('--fwdigestpath', dest='fwdigestpath', help='firmware update image digest path', type=str, nargs=1, metavar='path', default=["firmware.update.image.digest.txt"])
+    parser.add_argument('--delta', dest='delta', help='Only program the pages that differ from the firmware update image.', action='store_true')
+    parser.add_argument('--skip-blank', dest='skip_blank', help='Erase the pages that are entirely 0xFF in the firmware update image instead of writing them.', action='store_true')
+    parser.add_argument('--verify-chunks', dest='verify_chunks', help='Verify every chunk right after programming it and stop at the first mismatch.', action='store_true')
+    parser.add_argument('--retries', dest='retries', type=int, metavar='N', default=3, help='Times a chunk that failed to program is retried, after checking the link to the device.')
+    parser.add_argument('--resume', dest='resume', help='Continue an interrupted update from the first chunk not confirmed by the modem.', action='store_true')
+    parser.add_argument('--metrics-json', dest='metrics_json', type=str, metavar='path', help='Append per-phase timing and metrics as JSON lines to a file.')
+    parser.add_argument('--metrics-prom', dest='metrics_prom', type=str, metavar='path', help='Write per-phase timing and metrics as a Prometheus textfile.')
+    parser.add_argument('--results', dest='results', type=str, metavar='path', help='Write the results of --ops or --job as JSON to a file.')
+    parser.add_argument('--session', dest='session', help='Run the operation in the session server instead of initializing the device.', action='store_true')
+    parser.add_argument('--socket', dest='socket', type=str, metavar='path', help='Unix socket of the session server.')
+    parser.add_argument('--simulate', dest='simulate', help='Run against a simulated nrf9160 instead of a J-Link probe.', action='store_true')
+    parser.add_argument('--record-trace', dest='record_trace', type=str, metavar='path', help='Record every probe call with its timing to a JSON lines trace.')
+    parser.add_argument('--replay-trace', dest='replay_trace', type=str, metavar='path', help='Replay a recorded trace instead of using a J-Link probe.')
+    parser.add_argument('--replay-scale', dest='replay_scale', type=float, metavar='X', default=0.0, help='Fraction of the recorded time to wait during --replay-trace, 0 replays as fast as possible.')
 
     args = parser.parse_args()
-    nrf_dfu = nrf_dfu_API.nrf_dfu_API(quiet=args.quiet)
     if args.read is None and args.update is None:
         print ("No arguments found")
         return -1
 
     if args.read is not None:
-        if not "0x" in args.read[0]:
-            print("ERROR: Addr must be a hexadecimal number.")
-            return -1
-        elif not "0x" in args.read[1]:
-            print("ERROR: Len must be a hexadecimal number.")
-            return -1
-        if ((int(args.read[1], 16) % 4) != 0):
-            print("ERROR: number of bytes must be a multiple of 4")
+        if not check_read(args.read[0], args.read[1]):
             return -1
 
-    if args.update is not None:
-        if not os.path.isfile(args.fwpath[0]):
-            print ("ERROR: Missing file: firmware.update.image.hex")
+    if args.update:
+        if not check_update(args.fwpath[0], args.fwdigestpath[0]):
             return -1
-        if not os.path.isfile(args.fwdigestpath[0]):
-            print ("ERROR: Missing file: firmware.update.image.digest.txt")
+
+    steps = None
+    if args.ops is not None or args.job is not None:
+        steps = batch_steps(args)
+        if steps is None:
             return -1
 
     if ((args.ipcpath is not None) and (not os.path.isfile(args.ipcpath[0]))):
         print("ERROR: Missing file: ipc_dfu.*.ihex")
-    if nrf_dfu.init(args.snr, args.ipcpath) < 0:
-        nrf_dfu.close()
+    if ((args.ipcdir is not None) and (not os.path.isdir(args.ipcdir))):
+        print("ERROR: Missing directory: %s" % args.ipcdir)
+        return -1
+
+    if args.serve:
+        ipc_path = None
+        if args.ipcpath is not None:
+            ipc_path = [os.path.abspath(args.ipcpath[0])]
+        server = session_server.SessionServer(args.socket, ipc_path, args.simulate, args.ipcdir)
+        if (not args.quiet):
+            print("Session server listening on %s" % server.socket_path)
+        server.serve()
+        return 0
+
+    if args.station:
+        if not check_update(args.fwpath[0], args.fwdigestpath[0]):
+            return -1
+        return run_station(args)
+
+    if args.identity:
+        return read_identities(args)
+
+    if args.all or (args.snr is not None and len(args.snr) > 1):
+        if not args.update:
+            print("ERROR: Multiple devices are only supported with --update")
+            return -1
+        return update_many(args)
+
+    snr = None
+    if args.snr is not None:
+        snr = args.snr[0]
+    if args.calibrate:
+        return calibrate(args, snr)
+    if args.session:
+        if steps is None:
+            steps = command_steps(args)
+        return run_in_session(args, snr, steps)
+    probe = None
+    if args.simulate:
+        probe = sim_probe.SimulatedProbe(snr=snr)
+    elif args.replay_trace is not None:
+        probe = probe_trace.ReplayProbe(args.replay_trace, args.replay_scale)
+    if args.record_trace is not None:
+        probe = probe_trace.RecordingProbe(probe, args.record_trace)
+    catalog = None
+    if args.ipcdir is not None:
+        catalog = ipc_catalog.IpcCatalog(args.ipcdir)
+    nrf_dfu = nrf_dfu_API.nrf_dfu_API(quiet=args.quiet or args.progress, api=probe, ipc_catalog=catalog,
+                                      identity_cache=identity_cache.IdentityCache())
+    if args.progress:
+        nrf_dfu.metrics.add_listener(ProgressLine())
+    # Load the firmware image while the device is initialized.
+    for step in (steps or command_steps(args)):
+        if step["op"] == "update":
+            nrf_dfu.prepare_update(step["fw_path"])
+    if nrf_dfu.init(snr, args.ipcpath) < 0:
+        close(nrf_dfu, args)
         return -1
 
+    if steps is not None:
+        results = operations.run_batch(nrf_dfu, steps)
+        close(nrf_dfu, args)
+        return report_steps(args, snr, steps, results)
+
     if (args.read is not None):
         if nrf_dfu.read(args.read[0], args.read[1], args.read[2]) < 0:
-            nrf_dfu.close()
+            close(nrf_dfu, args)
             return -1
 
     elif (args.update):
-        if nrf_dfu.update_firmware(args.fwpath[0]) < 0:
-            nrf_dfu.close()
+        if nrf_dfu.update_firmware(args.fwpath[0], **update_options(args)) < 0:
+            close(nrf_dfu, args)
             return -1
 
         if nrf_dfu.verify_update(args.fwpath[0], args.fwdigestpath[0]) < 0:
-            nrf_dfu.close()
+            close(nrf_dfu, args)
             return -1
 
     elif (args.UUID):
         return_value, uuid_value = nrf_dfu.read_uuid()
         if return_value != 0:
-            nrf_dfu.close()
+            close(nrf_dfu, args)
             print("ERROR: Reading uuid failed")
             return -1
 
     elif args.digest:
         return_value, digest = nrf_dfu.read_digest()
         if return_value != 0:
-            nrf_dfu.close()
+            close(nrf_dfu, args)
             print("ERROR: Reading digest failed")
             return -1
 
     end = time.time()
     time_used = end - start
+    finish_progress(nrf_dfu)
     if (not args.quiet):
         print("Total time used: %f" % time_used)
+    close(nrf_dfu, args)
+
+    return 0
+
+
+def positive_int(text):
+    """
+    argparse type for counts that must be at least 1.
+    """
+    value = int(text)
+    if value < 1:
+        raise argparse.ArgumentTypeError("must be at least 1")
+    return value
+
+
+def close(nrf_dfu, args):
+    """
+    Exports the session metrics if requested and closes the device.
+    """
+    finish_progress(nrf_dfu)
+    labels = {}
+    if args.snr is not None:
+        labels["snr"] = args.snr[0]
+    if args.metrics_json is not None:
+        nrf_dfu.metrics.write_json_lines(args.metrics_json, **labels)
+    if args.metrics_prom is not None:
+        nrf_dfu.metrics.write_prometheus(args.metrics_prom, **labels)
     nrf_dfu.close()
 
+
+class ProgressLine(object):
+    """
+    Metrics listener that renders the current phase and transfer progress
+    as one line, rewritten in place.
+    """
+
+    def __init__(self, stream=sys.stdout):
+        self._stream = stream
+        self._width = 0
+
+    def __call__(self, event):
+        if event["type"] == "phase_start":
+            self._show("%s" % event["phase"])
+        elif event["type"] == "progress":
+            text = "%s %3d%% %d/%d bytes, %.1f kB/s (average %.1f kB/s)" % (
+                event["phase"], 100 * event["bytes"] // max(event["total"], 1), event["bytes"], event["total"],
+                event["throughput"] / 1000, event["average_throughput"] / 1000)
+            if event["modem_wait"] is not None:
+                text += ", modem wait %.1f s" % event["modem_wait"]
+            if event["eta"] is not None:
+                text += ", %.0f s left" % event["eta"]
+            self._show(text)
+
+    def _show(self, text):
+        # Pad with spaces to overwrite a longer previous line.
+        self._stream.write("\r" + text.ljust(self._width))
+        self._stream.flush()
+        self._width = len(text)
+
+    def finish(self):
+        if self._width:
+            self._stream.write("\n")
+            self._width = 0
+
+
+class ResultMetrics(object):
+    """
+    Exports the metrics of every device updated by update_many or the
+    station mode, labelled with its SNR.
+    """
+
+    def __init__(self, args):
+        self._json_path = args.metrics_json
+        self._prom_path = args.metrics_prom
+        self._sessions = {}
+
+    def __call__(self, result):
+        session = metrics.DfuMetrics()
+        session.records = result.records
+        if self._json_path is not None:
+            session.write_json_lines(self._json_path, snr=result.snr)
+        # The textfile holds the last session of every device.
+        self._sessions[result.snr] = session
+        if self._prom_path is not None:
+            metrics.write_prometheus(self._prom_path, [(self._sessions[snr], {"snr": snr})
+                                                       for snr in sorted(self._sessions)])
+
+
+def finish_progress(nrf_dfu):
+    """
+    Ends the --progress line, so the next output starts on a new line.
+    """
+    for listener in nrf_dfu.metrics.listeners:
+        if isinstance(listener, ProgressLine):
+            listener.finish()
+
+
+def update_options(args):
+    """
+    Returns the update_firmware keyword arguments selected on the command line.
+    """
+    return {"delta": args.delta, "journal": True, "resume": args.resume,
+            "skip_blank": args.skip_blank, "verify_chunks": args.verify_chunks, "retries": args.retries}
+
+
+def calibrate(args, snr):
+    """
+    Calibrates the probe and saves its tuning profile, used by later sessions with the same probe.
+    """
+    if args.simulate:
+        probe = sim_probe.SimulatedProbe(snr=snr)
+    else:
+        from pynrfjprog import API
+        probe = API.API("NRF91")
+    probe.open()
+    if snr is None:
+        probe.connect_to_emu_without_snr()
+        snr = probe.read_connected_emu_snr()
+        probe.disconnect_from_emu()
+
+    profile = tuning.calibrate(probe, snr, quiet=args.quiet)
+    probe.close()
+    if profile is None:
+        print("ERROR: No J-Link speed worked without errors")
+        return -1
+
+    tuning.save_profile(profile)
+    if (not args.quiet):
+        print("Saved tuning profile for %d: %d kHz, chunk size %d" %
+              (snr, profile["jlink_speed_khz"], profile["chunk_size"]))
+    return 0
+
+
+def check_read(address, length):
+    """
+    Checks the address and length of a read operation.
+    """
+    if not "0x" in address:
+        print("ERROR: Addr must be a hexadecimal number.")
+        return False
+    elif not "0x" in length:
+        print("ERROR: Len must be a hexadecimal number.")
+        return False
+    if ((int(length, 16) % 4) != 0):
+        print("ERROR: number of bytes must be a multiple of 4")
+        return False
+    return True
+
+
+def check_update(fw_path, fw_digest_path):
+    """
+    Checks that the files of an update operation exist.
+    """
+    if not os.path.isfile(fw_path):
+        print ("ERROR: Missing file: %s" % fw_path)
+        return False
+    if not os.path.isfile(fw_digest_path):
+        print ("ERROR: Missing file: %s" % fw_digest_path)
+        return False
+    return True
+
+
+def command_steps(args):
+    """
+    Returns the operation selected with --update, --read, --UUID or --digest as a list of one step.
+    """
+    if args.read is not None:
+        return [{"op": "read", "address": args.read[0], "length": args.read[1], "path": args.read[2]}]
+    elif args.update:
+        return [{"op": "update", "fw_path": args.fwpath[0], "fw_digest_path": args.fwdigestpath[0],
+                 "options": update_options(args)}]
+    elif args.UUID:
+        return [{"op": "uuid"}]
+    return [{"op": "digest"}]
+
+
+def batch_steps(args):
+    """
+    Returns the operations given with --ops or the --job file as a list of steps.
+
+    A job file holds a JSON list of steps such as {"op": "uuid"} or
+    {"op": "read", "address": "0x0", "length": "0x100", "path": "dump.hex"}.
+    Update steps default to the --fwpath, --fwdigestpath and update options
+    of the command line.
+
+    :return list of step dicts, or None if an operation is invalid:
+    """
+    if args.job is not None:
+        with open(args.job) as f:
+            entries = json.load(f)
+    else:
+        entries = args.ops
+
+    steps = []
+    for entry in entries:
+        if not isinstance(entry, dict):
+            fields = entry.split(":")
+            entry = {"op": fields[0]}
+            if fields[0] == "read":
+                if len(fields) != 4:
+                    print("ERROR: read operations are given as read:Addr:Len:file")
+                    return None
+                entry.update(address=fields[1], length=fields[2], path=fields[3])
+        step = dict(entry)
+        if step.get("op") not in operations.OPERATIONS:
+            print("ERROR: Unknown operation: %s" % step.get("op"))
+            return None
+        if step["op"] == "read" and not all(key in step for key in ("address", "length", "path")):
+            print("ERROR: read operations need address, length and path")
+            return None
+        if step["op"] == "read":
+            if not check_read(step["address"], step["length"]):
+                return None
+        elif step["op"] == "update":
+            step.setdefault("fw_path", args.fwpath[0])
+            step.setdefault("fw_digest_path", args.fwdigestpath[0])
+            step.setdefault("options", update_options(args))
+            if not check_update(step["fw_path"], step["fw_digest_path"]):
+                return None
+        steps.append(step)
+
+    return steps
+
+
+def report_steps(args, snr, steps, results):
+    """
+    Prints the result of each step, and writes them to the --results file if given.
+    """
+    for n, step in enumerate(steps):
+        if n < len(results):
+            step_result = results[n]
+            status = "OK" if step_result.success else "FAILED"
+            detail = step_result.value if step_result.success else step_result.error
+            print("%-8s %-8s %8.2f  %s" % (step["op"], status, step_result.duration, detail or ""))
+        else:
+            print("%-8s %-8s" % (step["op"], "SKIPPED"))
+
+    if args.results is not None:
+        with open(args.results, "w") as f:
+            json.dump({"snr": snr, "steps": [step_result.as_dict() for step_result in results]}, f, indent=2)
+
+    if len(results) == len(steps) and all(step_result.success for step_result in results):
+        return 0
+    return -1
+
+
+def run_in_session(args, snr, steps):
+    """
+    Runs the steps in a running session server.
+    """
+    try:
+        client = session_server.SessionClient(args.socket)
+    except OSError as e:
+        print("ERROR: No session server: %s" % e)
+        return -1
+
+    results = []
+    for step in steps:
+        message = dict(step, snr=snr)
+        for key in ("path", "fw_path", "fw_digest_path"):
+            if key in message:
+                message[key] = os.path.abspath(message[key])
+        if args.ipcpath is not None:
+            message["ipc_path"] = [os.path.abspath(args.ipcpath[0])]
+        start = time.time()
+        response = client.request(**message)
+        duration = time.time() - start
+        results.append(operations.StepResult(step["op"], response["result"], response.get("value"),
+                                             duration, response.get("error")))
+        if response["result"] < 0:
+            break
+    client.close()
+
+    return report_steps(args, snr, steps, results)
+
+
+def read_identities(args):
+    """
+    Prints the identity of every device given with -s / --snr or --all, one after the other.
+    """
+    if args.all:
+        snrs = multi_dfu.enumerate_probes()
+    else:
+        snrs = args.snr or [None]
+    catalog = None
+    if args.ipcdir is not None:
+        catalog = ipc_catalog.IpcCatalog(args.ipcdir)
+    cache = identity_cache.IdentityCache()
+
+    failed = 0
+    for snr in snrs:
+        probe = None
+        if args.simulate:
+            probe = sim_probe.SimulatedProbe(snr=snr)
+        nrf_dfu = nrf_dfu_API.nrf_dfu_API(quiet=True, api=probe, ipc_catalog=catalog, identity_cache=cache)
+        try:
+            return_value, identity = nrf_dfu.read_identity(snr, args.ipcpath, args.refresh)
+        except Exception as e:
+            return_value, identity = nrf_dfu_API.NrfDfuErr.NRFJPROG_ERRROR, None
+            print("ERROR: %s" % e)
+        nrf_dfu.close()
+        if return_value < 0:
+            print("%-12s ERROR: Reading identity failed" % snr)
+            failed += 1
+            continue
+        print("%-12s %-38s %s %s" % (identity["snr"], identity["uuid"], identity["root_key_digest"],
+                                     identity["fw_digest"] or "-"))
+
+    if failed:
+        return -1
     return 0
 
+
+def run_station(args):
+    """
+    Runs the hot-plug station mode and prints a summary table when stopped.
+    """
+    def job(snr):
+        return multi_dfu.DeviceJob(snr, args.fwpath[0], args.fwdigestpath[0], args.ipcpath, args.simulate,
+                                   update_options(args), args.ipcdir)
+
+    enumerate_probes = None
+    if args.simulate:
+        # Simulated boards are the ones given with -s / --snr.
+        enumerate_probes = lambda: args.snr or []
+    station_mode = station.Station(job, args.jobs or 4, args.queue, args.poll_interval, args.station_log,
+                                   enumerate_probes, args.quiet, ResultMetrics(args))
+    if (not args.quiet):
+        print("Waiting for boards, press Ctrl+C to stop")
+    results = station_mode.run()
+    multi_dfu.print_summary(results)
+
+    if all(device.success for device in results):
+        return 0
+    return -1
+
+
+def update_many(args):
+    """
+    Updates several devices in parallel and prints a summary table.
+    """
+    if args.all:
+        snrs = multi_dfu.enumerate_probes()
+    else:
+        snrs = []
+        for snr in args.snr:
+            if snr not in snrs:
+                snrs.append(snr)
+    if len(snrs) == 0:
+        print("ERROR: No devices found")
+        return -1
+
+    controllers = None
+    if args.controllers is not None:
+        with open(args.controllers) as f:
+            controllers = {int(snr): name for snr, name in json.load(f).items()}
+
+    jobs = [multi_dfu.DeviceJob(snr, args.fwpath[0], args.fwdigestpath[0], args.ipcpath, args.simulate, update_options(args), args.ipcdir)
+            for snr in snrs]
+    if not args.quiet:
+        print("Updating %d devices" % len(jobs))
+    results = multi_dfu.update_devices(jobs, args.jobs, args.max_per_controller, controllers)
+    export_metrics = ResultMetrics(args)
+    for device in results:
+        export_metrics(device)
+    multi_dfu.print_summary(results)
+
+    if all(device.success for device in results):
+        return 0
+    return -1
+
 if __name__ == "__main__":
     main()
 
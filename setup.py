@@ -12,8 +12,7 @@ PACKAGE_DATA = {
 }
 
 REQUIREMENTS = [
-    'pynrfjprog>=9.8.1',
-    'intelhex>=2.2.1'
+    'pynrfjprog>=9.8.1'
 ]
 
 setup(
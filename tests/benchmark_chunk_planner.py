@@ -0,0 +1,106 @@
+"""
+Compares the chunk planning of update_firmware with the loop it replaced.
+
+Only the chunk building is measured, without probe writes. Run with
+python tests/benchmark_chunk_planner.py [runs].
+"""
+import random
+import sys
+import time
+import tracemalloc
+
+from nrf9160_mdm_dfu.api import chunk_planner
+
+# Size of the shared DFU buffer used by update_firmware.
+BUFFER_SIZE = 0x3FC00 - 0x18
+
+
+def make_image(size=2 * 1024 * 1024, seed=1):
+    """
+    :return list of (address, list of ints) segments, as pynrfjprog's Hex
+        parser returns them: 64 KB segments, the first one not page aligned:
+    """
+    generator = random.Random(seed)
+    data = [generator.randrange(256) for i in range(size)]
+    segments = [(0x50000 + offset, data[offset:offset + 0x10000]) for offset in range(0, size, 0x10000)]
+    address, segment_data = segments[0]
+    segments[0] = (address + 0x100, segment_data[0x100:])
+    return segments
+
+
+def list_chunks(segments, buffer_size):
+    """
+    The per-segment loop of update_firmware before the planner, without
+    the probe writes. Chunks are built as lists of ints. Like the original,
+    it only handles segments smaller than the buffer.
+    """
+    for address, segment_data in segments:
+        length = len(segment_data)
+        max_length = len(segment_data)
+        start = 0
+        if (length > buffer_size - 1):
+            end = buffer_size
+            length = end - start
+        else:
+            end = length
+
+        while True:
+            data = []
+            if (address % 8192 != 0):
+                length += (address % 8192)
+                data = [0xFF] * (address % 8192)
+                address = address - (address % 8192)
+
+            data += segment_data[start:end]
+
+            if (length % 8192 != 0):
+                length += (length % 8192)
+                data += [0xFF] * (length % 8192)
+
+            yield address, length, data
+
+            if (length < buffer_size - 1):
+                break
+            start = start + length
+            address = address + length
+            end = min(end + length, max_length)
+
+
+def planner_chunks(blocks, buffer_size):
+    return chunk_planner.plan_chunks(blocks, buffer_size)
+
+
+def measure(function, argument, runs):
+    """
+    :return tuple of CPU seconds per run and peak allocation in bytes:
+    """
+    start = time.process_time()
+    for run in range(runs):
+        for chunk in function(argument, BUFFER_SIZE):
+            pass
+    duration = (time.process_time() - start) / runs
+
+    tracemalloc.start()
+    for chunk in function(argument, BUFFER_SIZE):
+        pass
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return duration, peak
+
+
+def main():
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    segments = make_image()
+    # The planner gets the page aligned blocks of a cached FirmwareImage.
+    blocks = [chunk_planner.align_block(address, bytes(data)) for address, data in segments]
+    size = sum(len(data) for address, data in segments)
+
+    print("Image of %d bytes in %d segments, %d runs" % (size, len(segments), runs))
+    for name, function, argument in (("list loop", list_chunks, segments),
+                                     ("plan_chunks", planner_chunks, blocks)):
+        duration, peak = measure(function, argument, runs)
+        print("%-12s %10.3f ms %10.1f KB peak" % (name, duration * 1000, peak / 1024.0))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import unittest
+
+from nrf9160_mdm_dfu.api import chunk_planner
+from nrf9160_mdm_dfu.api.chunk_planner import PAGE_SIZE
+
+BLANK_PAGE = b"\xff" * PAGE_SIZE
+
+
+def page(value):
+    return bytes([value]) * PAGE_SIZE
+
+
+class AlignBlockTest(unittest.TestCase):
+
+    def test_aligned_block_is_not_copied(self):
+        data = bytearray(page(1))
+        address, aligned = chunk_planner.align_block(0x10000, data)
+        self.assertEqual(address, 0x10000)
+        self.assertIs(aligned, data)
+
+    def test_unaligned_block_is_padded_to_whole_pages(self):
+        address, aligned = chunk_planner.align_block(0x10000 + 100, b"\x01" * 10)
+        self.assertEqual(address, 0x10000)
+        self.assertEqual(len(aligned), PAGE_SIZE)
+        self.assertEqual(bytes(aligned[:100]), b"\xff" * 100)
+        self.assertEqual(bytes(aligned[100:110]), b"\x01" * 10)
+        self.assertEqual(bytes(aligned[110:]), b"\xff" * (PAGE_SIZE - 110))
+
+    def test_block_ending_on_a_page_boundary_gets_no_back_padding(self):
+        address, aligned = chunk_planner.align_block(PAGE_SIZE - 4, b"\x01" * 4)
+        self.assertEqual(address, 0)
+        self.assertEqual(len(aligned), PAGE_SIZE)
+
+
+class PlanChunksTest(unittest.TestCase):
+
+    def test_chunks_are_the_largest_page_multiple_that_fits_the_buffer(self):
+        data = b"".join(page(n) for n in range(7))
+        ops = chunk_planner.plan_chunks([(0x50000, data)], 3 * PAGE_SIZE + 100)
+        self.assertEqual([(op.address, op.length) for op in ops],
+                         [(0x50000, 3 * PAGE_SIZE), (0x50000 + 3 * PAGE_SIZE, 3 * PAGE_SIZE),
+                          (0x50000 + 6 * PAGE_SIZE, PAGE_SIZE)])
+        self.assertEqual(b"".join(bytes(op.data) for op in ops), data)
+
+    def test_buffer_smaller_than_a_page_is_rejected(self):
+        with self.assertRaises(ValueError):
+            chunk_planner.plan_chunks([(0, page(1))], PAGE_SIZE - 1)
+
+    def test_chunks_are_views_into_aligned_blocks(self):
+        data = bytearray(page(1) * 2)
+        ops = chunk_planner.plan_chunks([(0, data)], PAGE_SIZE)
+        self.assertIsInstance(ops[1].data, memoryview)
+        data[PAGE_SIZE] = 0x42
+        self.assertEqual(ops[1].data[0], 0x42)
+
+    def test_unaligned_blocks_are_padded(self):
+        ops = chunk_planner.plan_chunks([(PAGE_SIZE + 8, b"\x01" * 8)], 4 * PAGE_SIZE)
+        self.assertEqual([(op.address, op.length) for op in ops], [(PAGE_SIZE, PAGE_SIZE)])
+        self.assertEqual(bytes(ops[0].data[:16]), b"\xff" * 8 + b"\x01" * 8)
+
+
+class PlanUpdateTest(unittest.TestCase):
+
+    def test_blank_pages_are_erased_instead_of_written(self):
+        data = page(1) + BLANK_PAGE + BLANK_PAGE + page(2)
+        ops, erases = chunk_planner.plan_update([(0, data)], 8 * PAGE_SIZE)
+        self.assertEqual([(op.address, op.length) for op in ops], [(0, PAGE_SIZE), (3 * PAGE_SIZE, PAGE_SIZE)])
+        self.assertEqual(erases, [(PAGE_SIZE, 2 * PAGE_SIZE)])
+
+    def test_blank_runs_are_merged_across_neighbouring_blocks(self):
+        blocks = [(0, page(1) + BLANK_PAGE), (2 * PAGE_SIZE, BLANK_PAGE + page(2))]
+        ops, erases = chunk_planner.plan_update(blocks, 8 * PAGE_SIZE)
+        self.assertEqual(erases, [(PAGE_SIZE, 2 * PAGE_SIZE)])
+        self.assertEqual([op.address for op in ops], [0, 3 * PAGE_SIZE])
+
+    def test_blank_runs_of_separate_blocks_are_not_merged(self):
+        blocks = [(0, BLANK_PAGE), (4 * PAGE_SIZE, BLANK_PAGE)]
+        ops, erases = chunk_planner.plan_update(blocks, 8 * PAGE_SIZE)
+        self.assertEqual(ops, [])
+        self.assertEqual(erases, [(0, PAGE_SIZE), (4 * PAGE_SIZE, PAGE_SIZE)])
+
+    def test_chunks_never_span_a_blank_page(self):
+        data = page(1) * 3 + BLANK_PAGE + page(2) * 3
+        ops, erases = chunk_planner.plan_update([(0, data)], 2 * PAGE_SIZE)
+        self.assertEqual([(op.address, op.length) for op in ops],
+                         [(0, 2 * PAGE_SIZE), (2 * PAGE_SIZE, PAGE_SIZE),
+                          (4 * PAGE_SIZE, 2 * PAGE_SIZE), (6 * PAGE_SIZE, PAGE_SIZE)])
+
+    def test_chunks_are_views_into_aligned_blocks(self):
+        data = bytearray(page(1) + BLANK_PAGE)
+        ops, erases = chunk_planner.plan_update([(0, data)], PAGE_SIZE)
+        data[0] = 0x42
+        self.assertEqual(ops[0].data[0], 0x42)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+
+from nrf9160_mdm_dfu.api import register_script
+from nrf9160_mdm_dfu.api.register_script import BARRIER, RegisterWrite
+
+
+class RecordingApi(object):
+    """
+    Records the write_u32 and write calls of run_script.
+    """
+
+    def __init__(self):
+        self.calls = []
+
+    def write_u32(self, addr, data, control):
+        self.calls.append(("write_u32", addr, data))
+
+    def write(self, addr, data, control):
+        self.calls.append(("write", addr, bytes(data)))
+
+
+class CoalesceTest(unittest.TestCase):
+
+    def test_consecutive_words_are_merged(self):
+        script = (RegisterWrite(0x1000, 1), RegisterWrite(0x1004, 2), RegisterWrite(0x1008, 3))
+        self.assertEqual(register_script.coalesce(script),
+                         [(0x1000, b"\x01\x00\x00\x00\x02\x00\x00\x00\x03\x00\x00\x00")])
+
+    def test_gaps_and_backward_writes_start_a_new_block(self):
+        script = (RegisterWrite(0x1000, 1), RegisterWrite(0x1008, 2), RegisterWrite(0x1004, 3))
+        self.assertEqual([address for address, data in register_script.coalesce(script)],
+                         [0x1000, 0x1008, 0x1004])
+
+    def test_writes_to_the_same_word_are_kept(self):
+        script = (RegisterWrite(0x1000, 1), RegisterWrite(0x1000, 0))
+        self.assertEqual(register_script.coalesce(script),
+                         [(0x1000, b"\x01\x00\x00\x00"), (0x1000, b"\x00\x00\x00\x00")])
+
+    def test_barrier_ends_a_run(self):
+        script = (RegisterWrite(0x1000, 1), BARRIER, RegisterWrite(0x1004, 2))
+        self.assertEqual(register_script.coalesce(script),
+                         [(0x1000, b"\x01\x00\x00\x00"), (0x1004, b"\x02\x00\x00\x00")])
+
+    def test_leading_and_repeated_barriers_add_no_blocks(self):
+        script = (BARRIER, BARRIER, RegisterWrite(0x1000, 1), BARRIER, BARRIER)
+        self.assertEqual(register_script.coalesce(script), [(0x1000, b"\x01\x00\x00\x00")])
+
+    def test_empty_script(self):
+        self.assertEqual(register_script.coalesce(()), [])
+
+    def test_modem_reset_keeps_every_toggle(self):
+        blocks = register_script.coalesce(register_script.MODEM_RESET)
+        self.assertEqual([address for address, data in blocks],
+                         [0x50005610, 0x50005614, 0x50005610, 0x50005614, 0x50005610])
+
+    def test_ram_permissions_are_one_block(self):
+        blocks = register_script.coalesce(register_script.RAM_PERMISSIONS)
+        self.assertEqual(len(blocks), 1)
+        self.assertEqual(blocks[0], (0x50003700, b"\x07\x00\x00\x00" * 32))
+
+
+class RunScriptTest(unittest.TestCase):
+
+    def test_single_words_use_write_u32(self):
+        api = RecordingApi()
+        script = (RegisterWrite(0x1000, 1), RegisterWrite(0x1004, 2), RegisterWrite(0x2000, 3))
+        self.assertEqual(register_script.run_script(api, script), 2)
+        self.assertEqual(api.calls, [("write", 0x1000, b"\x01\x00\x00\x00\x02\x00\x00\x00"),
+                                     ("write_u32", 0x2000, 3)])
+
+
+if __name__ == "__main__":
+    unittest.main()
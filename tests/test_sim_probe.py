@@ -0,0 +1,188 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import unittest
+
+from nrf9160_mdm_dfu.api import nrf_dfu_API, sim_probe
+from nrf9160_mdm_dfu.api.sim_probe import PAGE_SIZE, RAM_BASE
+
+MAILBOX = RAM_BASE + 0x0C
+DATA = RAM_BASE + 0x18
+
+
+def booted_probe(**kwargs):
+    """
+    :return SimulatedProbe with the DFU executable started:
+    """
+    probe = sim_probe.SimulatedProbe(**kwargs)
+    probe.write_u32(RAM_BASE, sim_probe.DFU_MAGIC, False)
+    probe.write_u32(sim_probe.MODEM_RESET, 1, False)
+    probe.write_u32(sim_probe.MODEM_RESET, 0, False)
+    wait_for_command(probe)
+    probe.write_u32(sim_probe.TASK_APP_CTRL, 1, False)
+    wait_for_command(probe)
+    return probe
+
+
+def wait_for_command(probe):
+    for i in range(10000):
+        if probe.read_u32(sim_probe.EVENT_COMMAND):
+            probe.write_u32(sim_probe.EVENT_COMMAND, 0, False)
+            return
+        probe.sleep(0.01)
+    raise AssertionError("The simulated modem did not answer")
+
+
+def run_command(probe, command, *arguments):
+    """
+    Writes the command and its argument words to the mailbox and runs it.
+
+    :return response word of the command:
+    """
+    probe.write_u32(MAILBOX, command, False)
+    for n, argument in enumerate(arguments):
+        probe.write_u32(MAILBOX + 0x04 + n * 4, argument, False)
+    probe.write_u32(sim_probe.TASK_APP_CTRL, 1, False)
+    wait_for_command(probe)
+    return probe.read_u32(MAILBOX)
+
+
+def hex_record(record_type, address, data):
+    body = bytes([len(data), address >> 8 & 0xFF, address & 0xFF, record_type]) + data
+    return ":%s%02X\n" % (body.hex().upper(), -sum(body) & 0xFF)
+
+
+def write_hex(path, segments):
+    """
+    Writes (address, bytes) segments as an Intel hex file.
+    """
+    with open(path, "w") as hex_file:
+        for address, data in segments:
+            for offset in range(0, len(data), 16):
+                if offset == 0 or (address + offset) % 0x10000 == 0:
+                    hex_file.write(hex_record(4, 0, ((address + offset) >> 16).to_bytes(2, "big")))
+                hex_file.write(hex_record(0, (address + offset) & 0xFFFF, data[offset:offset + 16]))
+        hex_file.write(hex_record(1, 0, b""))
+
+
+class ProtocolTest(unittest.TestCase):
+
+    def test_boot_publishes_the_root_key_digest(self):
+        probe = sim_probe.SimulatedProbe(boot_time=0.5)
+        probe.write_u32(RAM_BASE, sim_probe.DFU_MAGIC, False)
+        probe.write_u32(sim_probe.MODEM_RESET, 1, False)
+        probe.write_u32(sim_probe.MODEM_RESET, 0, False)
+        self.assertEqual(probe.read_u32(sim_probe.EVENT_COMMAND), 0)
+        wait_for_command(probe)
+        self.assertGreaterEqual(probe.time(), 0.5)
+        self.assertEqual(bytes(probe.read(RAM_BASE + 0x10, 32)), bytes(range(32)))
+
+    def test_modem_does_not_boot_without_the_dfu_magic(self):
+        probe = sim_probe.SimulatedProbe()
+        probe.write_u32(sim_probe.MODEM_RESET, 1, False)
+        probe.write_u32(sim_probe.MODEM_RESET, 0, False)
+        probe.sleep(1.0)
+        self.assertEqual(probe.read_u32(sim_probe.EVENT_COMMAND), 0)
+
+    def test_uuid_command(self):
+        probe = booted_probe(uuid="12345678-1234-1234-1234-123456789abc")
+        self.assertEqual(run_command(probe, sim_probe.COMMAND_UUID), sim_probe.RESPONSE_OK)
+        self.assertEqual(bytes(probe.read(RAM_BASE + 0x10, 36)), b"12345678-1234-1234-1234-123456789abc")
+
+    def test_write_and_erase(self):
+        probe = booted_probe()
+        data = bytes(range(256)) * (2 * PAGE_SIZE // 256)
+        probe.write(DATA, data, False)
+        self.assertEqual(run_command(probe, sim_probe.COMMAND_WRITE, 0x50000, len(data)), sim_probe.RESPONSE_OK)
+        self.assertEqual(probe.flash_contents(0x50000, len(data)), data)
+
+        self.assertEqual(run_command(probe, sim_probe.COMMAND_ERASE, 0x50000, PAGE_SIZE), sim_probe.RESPONSE_OK)
+        self.assertEqual(probe.flash_contents(0x50000, len(data)), b"\xff" * PAGE_SIZE + data[PAGE_SIZE:])
+
+    def test_unaligned_write_is_a_command_error(self):
+        probe = booted_probe()
+        self.assertEqual(run_command(probe, sim_probe.COMMAND_WRITE, 0x50004, 4), sim_probe.RESPONSE_COMMAND_ERROR)
+        self.assertEqual(probe.read_u32(RAM_BASE + 0x10), 0x50004)
+
+    def test_digest_is_the_sha256_of_the_ranges(self):
+        probe = booted_probe()
+        data = b"\x5a" * PAGE_SIZE
+        probe.write(DATA, data, False)
+        run_command(probe, sim_probe.COMMAND_WRITE, 0x50000, len(data))
+        # One range: the last 100 bytes of the written page and 100 blank bytes.
+        self.assertEqual(run_command(probe, sim_probe.COMMAND_DIGEST, 1, 0x50000 + PAGE_SIZE - 100, 200),
+                         sim_probe.RESPONSE_OK)
+
+        words = [probe.read_u32(RAM_BASE + 0x10 + i) for i in range(0, 32, 4)]
+        digest = b"".join(word.to_bytes(4, "big") for word in words)
+        self.assertEqual(digest, hashlib.sha256(b"\x5a" * 100 + b"\xff" * 100).digest())
+
+    def test_digest_beyond_the_limit_is_a_command_error(self):
+        probe = booted_probe()
+        self.assertEqual(run_command(probe, sim_probe.COMMAND_DIGEST, 1, sim_probe.DIGEST_LIMIT, 4),
+                         sim_probe.RESPONSE_COMMAND_ERROR)
+        self.assertEqual(probe.read_u32(RAM_BASE + 0x10), sim_probe.DIGEST_LIMIT)
+
+    def test_unknown_command(self):
+        probe = booted_probe()
+        self.assertEqual(run_command(probe, 0x42), sim_probe.RESPONSE_UNKNOWN_COMMAND)
+
+    def test_commands_take_virtual_time(self):
+        probe = booted_probe(page_erase_time=0.5)
+        start = probe.time()
+        run_command(probe, sim_probe.COMMAND_ERASE, 0x50000, 4 * PAGE_SIZE)
+        self.assertGreaterEqual(probe.time() - start, 2.0)
+
+    def test_reads_are_corrupted_above_the_maximum_speed(self):
+        probe = sim_probe.SimulatedProbe(max_swd_khz=1000)
+        probe.write(RAM_BASE, b"\x00" * 4, False)
+        probe.connect_to_emu_without_snr(jlink_speed_khz=4000)
+        self.assertNotEqual(probe.read(RAM_BASE, 4), [0, 0, 0, 0])
+        probe.connect_to_emu_without_snr(jlink_speed_khz=1000)
+        self.assertEqual(probe.read(RAM_BASE, 4), [0, 0, 0, 0])
+
+
+class UpdateTest(unittest.TestCase):
+    """
+    nrf_dfu_API runs a full update against the simulator.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.ipc_path = os.path.join(self.directory, "0001020.ipc_dfu.signed.ihex")
+        write_hex(self.ipc_path, [(RAM_BASE + 0x40, b"\x01" * 64)])
+
+        firmware = [(0x50000 + 0x100, bytes(range(256)) * 40), (0x60000, b"\xff" * (2 * PAGE_SIZE) + b"\x02" * 100)]
+        self.firmware = firmware
+        self.hex_path = os.path.join(self.directory, "firmware.update.image.hex")
+        write_hex(self.hex_path, firmware)
+        sha = hashlib.sha256()
+        for address, data in firmware:
+            sha.update(data)
+        self.digest_path = os.path.join(self.directory, "firmware.update.image.digest.txt")
+        with open(self.digest_path, "w") as digest_file:
+            digest_file.write("SHA256 of all ranges in ascending address order:\n%s\n" % sha.hexdigest().upper())
+
+        self.probe = sim_probe.SimulatedProbe()
+        self.dfu = nrf_dfu_API.nrf_dfu_API(quiet=True, api=self.probe, image_cache_dir=self.directory,
+                                           journal_dir=self.directory, profile_dir=self.directory)
+
+    def test_update_and_verify(self):
+        self.assertEqual(self.dfu.init(ipc_path=[self.ipc_path]), nrf_dfu_API.NrfDfuErr.SUCCESS)
+        self.assertEqual(self.dfu.update_firmware(self.hex_path), nrf_dfu_API.NrfDfuErr.SUCCESS)
+        for address, data in self.firmware:
+            self.assertEqual(self.probe.flash_contents(address, len(data)), data)
+        self.assertEqual(self.dfu.verify_update(self.hex_path, self.digest_path), nrf_dfu_API.NrfDfuErr.SUCCESS)
+
+    def test_wrong_digest_fails_verification(self):
+        with open(self.digest_path, "w") as digest_file:
+            digest_file.write("0" * 64 + "\n")
+        self.dfu.init(ipc_path=[self.ipc_path])
+        self.dfu.update_firmware(self.hex_path)
+        self.assertLess(self.dfu.verify_update(self.hex_path, self.digest_path), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,56 @@
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Makes importing the pynrfjprog probe API, and with it the J-Link library, fail.
+BLOCK_PROBE_API = "import sys; sys.modules['pynrfjprog.API'] = None; sys.modules['pynrfjprog.LowLevel'] = None\n"
+
+RUN_MAIN = "from nrf9160_mdm_dfu.bin.nrf9160_mdm_dfu import main\nsys.exit(main() or 0)\n"
+
+NOT_LOADED = ("loaded = sorted(m for m in sys.modules if m.startswith('pynrfjprog'))\n"
+              "assert not loaded, loaded\n")
+
+
+def run_python(code, args=(), cwd=None):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = ROOT
+    if cwd is not None:
+        env["HOME"] = cwd
+    return subprocess.run([sys.executable, "-c", code] + list(args), cwd=cwd, env=env,
+                          stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+
+
+class StartupTest(unittest.TestCase):
+    """
+    pynrfjprog is only loaded by the operations that need it.
+    """
+
+    def test_import_does_not_load_pynrfjprog(self):
+        result = run_python("import sys\nimport nrf9160_mdm_dfu.bin.nrf9160_mdm_dfu\n" + NOT_LOADED)
+        self.assertEqual(result.returncode, 0, result.stdout)
+
+    def test_help_does_not_load_pynrfjprog(self):
+        code = ("import sys\nfrom nrf9160_mdm_dfu.bin.nrf9160_mdm_dfu import main\n"
+                "sys.argv = ['nrf9160_mdm_dfu', '--help']\n"
+                "try:\n    main()\nexcept SystemExit:\n    pass\n" + NOT_LOADED)
+        result = run_python(code)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn("usage", result.stdout)
+
+    def test_simulate_without_probe_api(self):
+        with tempfile.TemporaryDirectory() as directory:
+            # IPC DFU executable for the root key digest of the simulator.
+            with open(os.path.join(directory, "0001020.ipc_dfu.signed.ihex"), "w") as f:
+                f.write(":0400000001020304F2\n:00000001FF\n")
+            code = "import sys\n" + BLOCK_PROBE_API + RUN_MAIN
+            result = run_python(code, ["--UUID", "--simulate"], cwd=directory)
+        self.assertEqual(result.returncode, 0, result.stdout)
+        self.assertIn("50503041-3633-4261-803d-1e2b8f70111a", result.stdout)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nrf9160_mdm_dfu.api import firmware_image, nrf_dfu_API, sim_probe, update_journal
+from nrf9160_mdm_dfu.api.sim_probe import PAGE_SIZE, RAM_BASE
+
+from test_sim_probe import write_hex
+
+
+class UpdateJournalTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.journal_dir = os.path.join(self.directory, "journal")
+
+    def test_missing_journal_has_no_confirmed_chunks(self):
+        journal = update_journal.UpdateJournal("1-uuid", "ab" * 32, self.journal_dir)
+        self.assertEqual(journal.confirmed(), [])
+
+    def test_recorded_chunks_are_confirmed_in_order(self):
+        journal = update_journal.UpdateJournal("1-uuid", "ab" * 32, self.journal_dir)
+        journal.record(0x50000, 0x2000)
+        journal.record(0x40000, 0x4000)
+        reopened = update_journal.UpdateJournal("1-uuid", "ab" * 32, self.journal_dir)
+        self.assertEqual(reopened.confirmed(), [(0x50000, 0x2000), (0x40000, 0x4000)])
+
+    def test_journals_are_kept_per_device_and_image(self):
+        journal = update_journal.UpdateJournal("1-uuid", "ab" * 32, self.journal_dir)
+        journal.record(0x50000, 0x2000)
+        self.assertEqual(update_journal.UpdateJournal("2-uuid", "ab" * 32, self.journal_dir).confirmed(), [])
+        self.assertEqual(update_journal.UpdateJournal("1-uuid", "cd" * 32, self.journal_dir).confirmed(), [])
+
+    def test_device_id_is_a_safe_file_name(self):
+        journal = update_journal.UpdateJournal("../1 uuid/x", "ab" * 32, self.journal_dir)
+        self.assertEqual(os.path.dirname(journal.path), self.journal_dir)
+
+    def test_line_cut_short_ends_the_confirmed_chunks(self):
+        journal = update_journal.UpdateJournal("1-uuid", "ab" * 32, self.journal_dir)
+        journal.record(0x50000, 0x2000)
+        with open(journal.path, "a") as f:
+            f.write('{"address": 3')
+        journal.record(0x60000, 0x2000)
+        self.assertEqual(journal.confirmed(), [(0x50000, 0x2000)])
+
+    def test_remove(self):
+        journal = update_journal.UpdateJournal("1-uuid", "ab" * 32, self.journal_dir)
+        journal.record(0x50000, 0x2000)
+        journal.remove()
+        self.assertEqual(journal.confirmed(), [])
+        journal.remove()
+
+
+class ResumeTest(unittest.TestCase):
+    """
+    update_firmware skips the chunks confirmed in the journal.
+    """
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        ipc_path = os.path.join(self.directory, "0001020.ipc_dfu.signed.ihex")
+        write_hex(ipc_path, [(RAM_BASE + 0x40, b"\x01" * 64)])
+        # 40 pages: one full chunk of the DFU buffer and a second, shorter one.
+        self.data = b"".join(bytes([n]) * PAGE_SIZE for n in range(40))
+        self.hex_path = os.path.join(self.directory, "firmware.update.image.hex")
+        write_hex(self.hex_path, [(0x50000, self.data)])
+
+        self.probe = sim_probe.SimulatedProbe()
+        self.dfu = nrf_dfu_API.nrf_dfu_API(quiet=True, api=self.probe, image_cache_dir=self.directory,
+                                           journal_dir=self.directory, profile_dir=self.directory)
+        self.assertEqual(self.dfu.init(ipc_path=[ipc_path]), nrf_dfu_API.NrfDfuErr.SUCCESS)
+        return_value, device_id = self.dfu.device_id()
+        self.journal = update_journal.UpdateJournal(device_id, firmware_image.file_sha256(self.hex_path),
+                                                    self.directory)
+
+    def test_journal_records_every_chunk(self):
+        self.assertEqual(self.dfu.update_firmware(self.hex_path, journal=True), nrf_dfu_API.NrfDfuErr.SUCCESS)
+        chunks = self.journal.confirmed()
+        self.assertEqual(chunks[0][0], 0x50000)
+        self.assertEqual(sum(length for address, length in chunks), len(self.data))
+
+    def test_resume_skips_confirmed_chunks(self):
+        chunk = (nrf_dfu_API.BUFFER_SIZE // PAGE_SIZE) * PAGE_SIZE
+        self.journal.record(0x50000, chunk)
+        self.assertEqual(self.dfu.update_firmware(self.hex_path, resume=True), nrf_dfu_API.NrfDfuErr.SUCCESS)
+        self.assertEqual(self.probe.flash_contents(0x50000, chunk), b"\xff" * chunk)
+        self.assertEqual(self.probe.flash_contents(0x50000 + chunk, len(self.data) - chunk), self.data[chunk:])
+
+    def test_mismatching_journal_starts_over(self):
+        self.journal.record(0x70000, PAGE_SIZE)
+        self.assertEqual(self.dfu.update_firmware(self.hex_path, resume=True), nrf_dfu_API.NrfDfuErr.SUCCESS)
+        self.assertEqual(self.probe.flash_contents(0x50000, len(self.data)), self.data)
+        self.assertNotIn((0x70000, PAGE_SIZE), self.journal.confirmed())
+
+
+if __name__ == "__main__":
+    unittest.main()